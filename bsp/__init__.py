@@ -1,14 +1,19 @@
+import os
+
 from bsp.schemas import config, types
-from bsp.registration import Registrar
+from bsp.registration import Registrar, RegistryManifest
 from bsp.implementations import INITIAL_MODULES
 
 
 VERBOSE_REGISTRATION = False
 ATTEMPT_INSTALL = False
+LAZY_REGISTRATION = True  # import each implementation only when its address is first accessed
+# opt-in: set $BSP_REGISTRY_MANIFEST to a filepath to persist, and skip, implementations not importable here
+REGISTRY_MANIFEST = bool(os.getenv('BSP_REGISTRY_MANIFEST'))
 
 
 # project-scoped process/implementation registrar
-app_registrar = Registrar()
+app_registrar = Registrar(lazy=LAZY_REGISTRATION, manifest=RegistryManifest() if REGISTRY_MANIFEST else None)
 
 
 #  register types:
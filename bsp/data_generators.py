@@ -250,13 +250,8 @@ def run_smoldyn(model_fp: str, duration: int, dt: float = None) -> Dict[str, Uni
     else:
         smoldyn = smoldyn.module
 
-    use_file_output = False
     with open(model_fp, 'r') as f:
-        model_content = [line.strip() for line in f.readlines()]
-        for content in model_content:
-            if content.startswith('output_files'):
-                use_file_output = True
-        f.close()
+        use_file_output = any(line.strip().startswith('output_files') for line in f)
 
     simulation = smoldyn.Simulation.fromFile(model_fp)
     try:
@@ -389,7 +384,8 @@ def run_sbml_copasi(sbml_fp: str, start: int, dur: int, steps: int) -> Dict[str,
 
     try:
         t = np.linspace(start, dur, steps + 1)
-        model = basico.load_model(sbml_fp)
+        from bsp.utils.copasi_utils import load_cached_model
+        model = load_cached_model(sbml_fp)
         specs = basico.get_species(model=model).index.tolist()
         for spec in specs:
             if spec == "EmptySet" or "EmptySet" in spec:
@@ -411,24 +407,14 @@ def run_sbml_amici(sbml_fp: str, start: int, dur: int, steps: int) -> Dict[str,
         return {'error': error}
     else:
         amici = amici.module
+    from bsp.utils.amici_utils import AMICI_MODEL_STORE
 
     try:
         sbml_reader = libsbml.SBMLReader()
         sbml_doc = sbml_reader.readSBML(sbml_fp)
         sbml_model_object = sbml_doc.getModel()
-        sbml_importer = amici.SbmlImporter(sbml_fp)
         model_id = sbml_fp.split('/')[-1].replace('.xml', '')
-        model_output_dir = mkdtemp()
-        sbml_importer.sbml2amici(
-            model_id,
-            model_output_dir,
-            verbose=logging.INFO,
-            observables=None,
-            sigmas=None,
-            constant_parameters=None
-        )
-        # model_output_dir = model_id  # mkdtemp()
-        model_module = amici.import_model_module(model_id, model_output_dir)
+        model_module = AMICI_MODEL_STORE.get_model_module(sbml_fp, model_id)
         amici_model_object = model_module.getModel()
         floating_species_list = list(amici_model_object.getStateIds())
         floating_species_initial = list(amici_model_object.getInitialStates())
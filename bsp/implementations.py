@@ -20,6 +20,11 @@ COBRA_PROCESSES = [
         location='processes.cobra_process.DynamicFBA',
         dependencies=["cobra", "imageio"]
 
+    ),
+    Implementation(
+        address='spatial-dynamic-fba',
+        location='processes.cobra_process.SpatialDynamicFBA',
+        dependencies=["cobra", "imageio"]
     )
 ]
 
@@ -33,6 +38,11 @@ COPASI_PROCESSES = [
         address='sed-copasi-process',
         location='processes.copasi_process.SedCopasiProcess',
         dependencies=["copasi-basico"]
+    ),
+    Implementation(
+        address='sed-copasi-ensemble-process',
+        location='processes.copasi_process.SedCopasiEnsembleProcess',
+        dependencies=["copasi-basico"]
     )
 ]
 
@@ -68,7 +78,15 @@ SMOLDYN_PROCESSES = [
 #     )
 # ]
 
-PROCESS_IMPLEMENTATIONS = COBRA_PROCESSES + COPASI_PROCESSES + MEM3DG_PROCESSES + SMOLDYN_PROCESSES  # + TELLURIUM_PROCESSES
+FIELD_PROCESSES = [
+    Implementation(
+        address='field-transport',
+        location='processes.field_transport_process.FieldTransport',
+        dependencies=["scipy"]
+    )
+]
+
+PROCESS_IMPLEMENTATIONS = COBRA_PROCESSES + COPASI_PROCESSES + MEM3DG_PROCESSES + SMOLDYN_PROCESSES + FIELD_PROCESSES  # + TELLURIUM_PROCESSES
 
 
 STEP_IMPLEMENTATIONS = [
@@ -1,9 +1,13 @@
+import hashlib
+import json
 import os
 import re
+import shutil
 import zipfile as zf
 import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
 from tempfile import mkdtemp
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Union
 from pathlib import Path
 
 import h5py
@@ -11,6 +15,8 @@ import numpy as np
 import requests
 import libsbml
 
+from bsp.utils.base_utils import file_lock
+
 
 class FilePath(Path):
     name: str
@@ -20,11 +26,142 @@ class FilePath(Path):
         self.name = name
 
 
+# -- local BioModels mirror --
+
+BIOMODEL_ID_PATTERN = re.compile(r'(BIOMD\d{10}|MODEL\d{10})')
+
+
+class BiomodelStore(object):
+    """Local content store of BioModels SBML files which is consulted before the BioModels API.
+
+        The store is a directory holding one `<biomodel_id>.xml` file per model and an `index.json` mapping each id
+        to its SBML path, SHA-256 checksum and fetch date. Writes (`add`, `populate`) are serialized across worker
+        processes with a lock file and the index is replaced atomically, so reads never need to take the lock.
+
+        Args:
+            root:`Optional[str]`: store directory. Defaults to `$BSP_BIOMODELS_DIR`, or `~/.bsp/biomodels`.
+    """
+    index_filename = 'index.json'
+    lock_filename = 'index.lock'
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or os.getenv('BSP_BIOMODELS_DIR') or os.path.join(os.path.expanduser('~'), '.bsp', 'biomodels')
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.root, self.index_filename)
+
+    def read_index(self) -> Dict[str, Dict[str, str]]:
+        try:
+            with open(self.index_path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def get(self, biomodel_id: str) -> Optional[str]:
+        """Return the local SBML path of `biomodel_id`, or `None` if it is not in the store."""
+        entry = self.read_index().get(biomodel_id)
+        if entry is not None and os.path.exists(entry['path']):
+            return entry['path']
+
+        return None
+
+    def verify(self, biomodel_id: str) -> bool:
+        """Check the stored SBML file of `biomodel_id` against its indexed checksum."""
+        entry = self.read_index().get(biomodel_id)
+        if entry is None or not os.path.exists(entry['path']):
+            return False
+        with open(entry['path'], 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest() == entry['checksum']
+
+    def add(self, biomodel_id: str, sbml_content: Union[str, bytes]) -> str:
+        """Write the SBML content of `biomodel_id` into the store and return its path."""
+        return self.add_many({biomodel_id: sbml_content})[biomodel_id]
+
+    def try_add(self, biomodel_id: str, sbml_content: Union[str, bytes]) -> Optional[str]:
+        """Best-effort `add`: return the stored path, or None if the store cannot be written."""
+        try:
+            return self.add(biomodel_id, sbml_content)
+        except OSError as e:
+            print(f'Cannot write {biomodel_id} to the BioModels store at {self.root}: {e}')
+            return None
+
+    def add_many(self, sbml_contents: Dict[str, Union[str, bytes]]) -> Dict[str, str]:
+        os.makedirs(self.root, exist_ok=True)
+        with file_lock(os.path.join(self.root, self.lock_filename)):
+            index = self.read_index()
+            fetched = datetime.now(timezone.utc).isoformat()
+            paths = {}
+            for biomodel_id, content in sbml_contents.items():
+                if isinstance(content, str):
+                    content = content.encode()
+                path = os.path.join(self.root, f'{biomodel_id}.xml')
+                self._atomic_write(path, content)
+                index[biomodel_id] = {
+                    'path': path,
+                    'checksum': hashlib.sha256(content).hexdigest(),
+                    'fetched': fetched
+                }
+                paths[biomodel_id] = path
+            self._atomic_write(self.index_path, json.dumps(index, indent=2).encode())
+
+        return paths
+
+    def populate(self, source: str) -> List[str]:
+        """Bulk-add every SBML file found in a directory or a zip archive. The BioModels id of each file is
+            parsed from its filename. Returns the ids which were added.
+        """
+        contents = {}
+        if zf.is_zipfile(source):
+            with zf.ZipFile(source, 'r') as archive:
+                for member in archive.namelist():
+                    match = BIOMODEL_ID_PATTERN.search(os.path.basename(member))
+                    if match and member.endswith('.xml'):
+                        contents[match.group(1)] = archive.read(member)
+        else:
+            for root, _, files in os.walk(source):
+                for filename in files:
+                    match = BIOMODEL_ID_PATTERN.search(filename)
+                    if match and filename.endswith('.xml'):
+                        with open(os.path.join(root, filename), 'rb') as f:
+                            contents[match.group(1)] = f.read()
+
+        self.add_many(contents)
+        return list(contents.keys())
+
+    @staticmethod
+    def _atomic_write(path: str, content: bytes) -> None:
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+
+BIOMODEL_STORE = BiomodelStore()
+
+
+def biomodels_offline() -> bool:
+    return os.getenv('BSP_OFFLINE', '').lower() in ('1', 'true', 'yes')
+
+
 def fetch_biomodel_sbml_file(biomodel_id: str, save_dir: Optional[str] = None) -> FilePath:
+    model_filename = f'{biomodel_id}.xml'
+
+    # consult the local mirror first
+    stored_path = BIOMODEL_STORE.get(biomodel_id)
+    if stored_path is not None:
+        if save_dir is None:
+            return FilePath(stored_path, name=model_filename)
+        p = os.path.join(save_dir, model_filename)
+        shutil.copyfile(stored_path, p)
+        return FilePath(p, name=model_filename)
+
+    if biomodels_offline():
+        raise FileNotFoundError(f'{biomodel_id} is not in the local BioModels store at {BIOMODEL_STORE.root} and BSP_OFFLINE is set.')
+
     url = f'https://www.ebi.ac.uk/biomodels/search/download?models={biomodel_id}'
     headers = {'accept': '*/*'}
     response = requests.get(url, headers=headers)
-    model_filename = f'{biomodel_id}.xml'
     dirpath = save_dir or mkdtemp()  # os.getcwd()
     response_zip_fp = os.path.join(dirpath, 'results.zip')
     if not os.path.exists(response_zip_fp):
@@ -37,10 +174,15 @@ def fetch_biomodel_sbml_file(biomodel_id: str, save_dir: Optional[str] = None) -
 
             os.remove(response_zip_fp)
             p = os.path.join(dirpath, model_filename)
-
-            return FilePath(p, name=model_filename)
         except Exception as e:
             print(e)
+            return None
+
+        # mirror the download for subsequent calls, without failing the download if the store is not writable
+        with open(p, 'rb') as f:
+            stored_path = BIOMODEL_STORE.try_add(biomodel_id, f.read())
+
+        return FilePath(p if save_dir or stored_path is None else stored_path, name=model_filename)
 
 
 def read_xyz(xyz_filepath: os.PathLike[str]) -> str:
@@ -1,15 +1,15 @@
 import os
-import logging
 from tempfile import mkdtemp
 
 import libsbml
 import numpy as np
 import seaborn as sns
-from amici import amici, SbmlImporter, import_model_module, runAmiciSimulation
+from amici import amici, runAmiciSimulation
 from matplotlib import pyplot as plt
 from process_bigraph import Step
 
 from bsp.data_model.sed import UTC_CONFIG_TYPE
+from bsp.utils.amici_utils import AmiciModelStore, AMICI_MODEL_STORE, build_exp_data, run_batch, configure_sensitivities
 from bsp.utils.helpers import calc_duration, calc_num_steps, calc_step_size, check_ode_kisao_term
 
 
@@ -19,7 +19,8 @@ class UtcAmici(Step):
             config:`Dict`: dict keys include:
                 model: SED Model Spec.
                 species_context: Context by which to measure species outputs (defaults to concentrations).
-                model_output_dir: Dirpath in which to save the AMICI model output.
+                model_output_dir: Dirpath of the compiled AMICI model store. Defaults to the shared store
+                    (`$BSP_AMICI_MODEL_DIR` or `~/.bsp/amici_models`), so that a model is compiled only once.
                 observables: for example:
                     observables = {
                         "observable_x1": {"name": "", "formula": "x1"},
@@ -33,18 +34,35 @@ class UtcAmici(Step):
                     constant_parameters = ["k0"]
                 sigmas: for example:
                     sigmas = {"observable_x1withsigma": "observable_x1withsigma_sigma"}
+                batch_size: Number of initial-condition/parameter sets simulated per update. If greater than 0, the
+                    step reads `batch_floating_species` (batch × state) and `batch_model_parameters`
+                    (batch × parameter), each initially holding the model defaults for every member, and outputs
+                    `batch_floating_species` as a (batch × time × state) array.
+                num_threads: Number of threads over which a batch is distributed by `runAmiciSimulations`.
+                sensitivity_method: Either 'forward' or 'adjoint'. If set, the step outputs the state sensitivities
+                    `sx` (time × parameter × state, forward only) and the log-likelihood gradient `sllh` (parameter)
+                    on the `sensitivities` port, both with respect to the parameters ordered as
+                    `getParameterIds()`. `sllh` is computed only against a `measurements` input (time × observable),
+                    which the adjoint method requires. Sensitivities which AMICI has not computed are output as NaN.
+                    Not supported in batch mode.
 
     """
     config_schema = UTC_CONFIG_TYPE
 
     # AMICI-specific fields
-    config_schema['model_output_dir'] = {
-        '_default': mkdtemp(),
-        '_type': 'string'
-    }
+    config_schema['model_output_dir'] = 'maybe[string]'
     config_schema['observables'] = 'maybe[tree[string]]'
     config_schema['constant_parameters'] = 'maybe[list[string]]'
     config_schema['sigmas'] = 'maybe[tree[string]]'
+    config_schema['batch_size'] = {
+        '_default': 0,
+        '_type': 'integer'
+    }
+    config_schema['num_threads'] = {
+        '_default': 1,
+        '_type': 'integer'
+    }
+    config_schema['sensitivity_method'] = 'maybe[string]'
 
     def __init__(self,
                  config=None,
@@ -99,18 +117,16 @@ class UtcAmici(Step):
         model_id = self.config['model'].get('model_id', None) \
             or model_fp.split('/')[-1].replace('.', '_').split('_')[0]
 
-        model_output_dir = self.config['model_output_dir']
+        model_output_dir = self.config.get('model_output_dir')
+        model_store = AmiciModelStore(root=model_output_dir) if model_output_dir else AMICI_MODEL_STORE
 
-        # compile sbml to amici
-        sbml_importer = SbmlImporter(model_fp)
-        sbml_importer.sbml2amici(
-            model_name=model_id,
-            output_dir=model_output_dir,
-            verbose=logging.INFO,
+        # compile sbml to amici, or import the module compiled previously for the same model and settings
+        model_module = model_store.get_model_module(
+            sbml_fp=model_fp,
+            model_id=model_id,
             observables=self.config.get('observables'),
             constant_parameters=self.config.get('constant_parameters'),
             sigmas=self.config.get('sigmas'))
-        model_module = import_model_module(model_id, model_output_dir)
         self.amici_model_object: amici.Model = model_module.getModel()
 
         # set species context (concentrations for ODE by default)
@@ -158,7 +174,28 @@ class UtcAmici(Step):
         self._results = {}
         self.output_keys = [list(self.sbml_species_mapping.keys())[i] for i, spec_id in enumerate(self.floating_species_list)]
 
+        # batch mode
+        self.batch_size = self.config.get('batch_size', 0)
+        self.num_threads = self.config.get('num_threads', 1)
+        self.model_parameter_ids = list(self.amici_model_object.getParameterIds())
+
+        # sensitivities
+        self.sensitivity_method = self.config.get('sensitivity_method')
+        if self.sensitivity_method and self.batch_size:
+            # the batch outputs have no sensitivities port
+            raise ValueError('"sensitivity_method" is not supported in batch mode ("batch_size" > 0).')
+        if self.sensitivity_method:
+            configure_sensitivities(self.amici_model_object, self.method, self.sensitivity_method)
+
     def initial_state(self):
+        if self.batch_size:
+            # every batch member starts from the model defaults
+            return {
+                'time': [0.0],
+                f'batch_{self.species_context_key}': np.tile(self.floating_species_initial, (self.batch_size, 1)),
+                'batch_model_parameters': np.tile(self.amici_model_object.getParameters(), (self.batch_size, 1))
+            }
+
         species_initial = dict(zip(self.floating_species_list, self.floating_species_initial))
         model_params_initial = dict(zip(self.model_parameters_list, self.model_parameters_values))
         return {
@@ -224,18 +261,52 @@ class UtcAmici(Step):
         else:
             self.step_size = calc_step_size(self.duration, self.num_steps)
 
+    @staticmethod
+    def _array_type(*shape):
+        return {
+            '_type': 'array',
+            '_shape': shape,
+            '_data': 'float',
+            '_apply': 'set'
+        }
+
+    def _batch_type(self, *shape):
+        return self._array_type(self.batch_size, *shape)
+
     def inputs(self):
         # dependent on species context set in self.config
-        return {
+        if self.batch_size:
+            return {
+                'time': 'list[float]',
+                f'batch_{self.species_context_key}': self._batch_type(len(self.floating_species_list)),
+                'batch_model_parameters': self._batch_type(len(self.model_parameter_ids))}
+
+        ports = {
             'time': 'list[float]',
             self.species_context_key: 'tree[float]',
             'model_parameters': 'tree[float]',
             'reactions': 'list[string]'}
+        if self.sensitivity_method:
+            ports['measurements'] = {
+                '_type': 'maybe',
+                '_value': self._array_type(len(self.t), self.amici_model_object.ny)}
+        return ports
 
     def outputs(self):
-        return {
+        if self.batch_size:
+            return {
+                'time': 'list[float]',
+                f'batch_{self.species_context_key}': self._batch_type(len(self.t), len(self.floating_species_list))}
+
+        ports = {
             'time': 'list[float]',
             self.species_context_key: 'tree[float]'}  # floating_species_type}
+        if self.sensitivity_method:
+            n_parameters = len(self.model_parameter_ids)
+            ports['sensitivities'] = {
+                'sx': self._array_type(len(self.t), n_parameters, len(self.floating_species_list)),
+                'sllh': self._array_type(n_parameters)}
+        return ports
 
     def _generate_results(self, inputs=None):
         x = inputs or self.initial_state()
@@ -245,18 +316,68 @@ class UtcAmici(Step):
                 set_values.append(value)
             self.amici_model_object.setInitialStates(set_values)
 
-        result_data = runAmiciSimulation(solver=self.method, model=self.amici_model_object)
+        edata = self._measurement_data(x.get('measurements')) if self.sensitivity_method else None
+        result_data = runAmiciSimulation(solver=self.method, model=self.amici_model_object, edata=edata)
 
         # TODO: ensure that `keys` are threadsafe.
         floating_species_results = dict(zip(
             self.output_keys,
             list(map(lambda x: result_data.by_id(f'{x}'), self.floating_species_list))))
 
-        return {
+        results = {
             'time': self.t,
             self.species_context_key: floating_species_results}
+        if self.sensitivity_method:
+            results['sensitivities'] = self._sensitivity_results(result_data, measured=edata is not None)
+        return results
+
+    def _measurement_data(self, measurements=None):
+        if measurements is None:
+            if self.sensitivity_method == 'adjoint':
+                raise ValueError('Adjoint sensitivities require the "measurements" input.')
+            return None
+        edata = amici.ExpData(self.amici_model_object)
+        edata.setObservedData(np.asarray(measurements, dtype=float).flatten().tolist())
+        return edata
+
+    def _sensitivity_results(self, result_data, measured: bool):
+        # sensitivities which were not computed are NaN rather than a zero gradient
+        n_parameters = len(self.model_parameter_ids)
+        sx = np.full((len(self.t), n_parameters, len(self.floating_species_list)), np.nan)
+        if self.sensitivity_method == 'forward' and result_data.sx is not None:
+            sx = np.asarray(result_data.sx)
+        sllh = np.full(n_parameters, np.nan)
+        if measured and result_data.sllh is not None:
+            sllh = np.asarray(result_data.sllh)
+        return {
+            'sx': sx,
+            'sllh': sllh}
+
+    def _batch_input(self, inputs, port: str, defaults) -> np.ndarray:
+        value = inputs.get(port)
+        if value is None:
+            return np.tile(defaults, (self.batch_size, 1))
+        value = np.asarray(value, dtype=float)
+        expected_shape = (self.batch_size, len(defaults))
+        if value.shape != expected_shape:
+            raise ValueError(f'"{port}" must have shape {expected_shape} (batch_size × values), got {value.shape}.')
+        return value
+
+    def _generate_batch_results(self, inputs=None):
+        inputs = inputs or self.initial_state()
+        initial_states = self._batch_input(
+            inputs, f'batch_{self.species_context_key}', self.floating_species_initial)
+        parameters = self._batch_input(
+            inputs, 'batch_model_parameters', list(self.amici_model_object.getParameters()))
+
+        edata_list = build_exp_data(self.amici_model_object, initial_states, parameters)
+        batch_results = run_batch(self.amici_model_object, self.method, edata_list, self.num_threads)
+
+        return {
+            'time': self.t,
+            f'batch_{self.species_context_key}': batch_results}
 
     def update(self, inputs=None):
-        results = self._generate_results(inputs)
+        results = self._generate_batch_results(inputs) if self.batch_size else self._generate_results(inputs)
         self._results = results.copy()
         return results
@@ -12,11 +12,12 @@ import numpy as np
 import warnings
 
 import cobra
-from cobra.io import load_model
+from cobra.flux_analysis import flux_variability_analysis, pfba
 from process_bigraph import Process, Composite
 
 from bsp.data_model.sed import SedModel
 from bsp.schemas.config import TimeCourseConfig
+from bsp.utils.cobra_utils import COBRA_MODELS, IncrementalFBA, ParallelFBAPool, get_solution_cache
 from bsp.viz.plot import plot_time_series, plot_species_distributions_to_gif
 
 
@@ -29,12 +30,18 @@ warnings.filterwarnings("ignore", category=FutureWarning, module="cobra.medium.b
 
 
 # TODO -- can set lower and upper bounds by config instead of hardcoding
-MODEL_FOR_TESTING = load_model('textbook')
 # MODEL_FOR_TESTING.reactions.EX_o2_e.lower_bound = -2  # Limiting oxygen uptake
 # MODEL_FOR_TESTING.reactions.ATPM.lower_bound = 1     # Setting lower bound for ATP maintenance
 # MODEL_FOR_TESTING.reactions.ATPM.upper_bound = 1     # Setting upper bound for ATP maintenance
 
 
+def __getattr__(name):
+    # MODEL_FOR_TESTING is loaded on first access rather than at import
+    if name == 'MODEL_FOR_TESTING':
+        return COBRA_MODELS.get('TESTING', copy=False)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
 class CobraProcess(Process):
     """FBA component of the dfba hybrid using COBRA."""
     config_schema = {
@@ -53,7 +60,7 @@ class CobraProcess(Process):
         model_file = self.config['model']['model_source']
         data_dir = Path(os.path.dirname(model_file))
         path = data_dir / model_file.split('/')[-1]
-        self.model = load_model(str(path.resolve()))  # read_sbml_model(str(path.resolve()))
+        self.model = COBRA_MODELS.get(str(path.resolve()))  # read_sbml_model(str(path.resolve()))
 
         # parse objective
         self.objective_domain = self.config['objective']['domain']
@@ -72,14 +79,15 @@ class CobraProcess(Process):
             self.model.reactions.get_by_id(reaction.id).lower_bound = -rand_bound  # TODO: What to do here?
             self.model.reactions.get_by_id(reaction.id).upper_bound = rand_bound
 
+        # index reactions by name and by id, so that the fluxes output (keyed by id) can be fed back as input
+        self.reaction_index = {reaction.name: reaction for reaction in self.model.reactions}
+        self.reaction_index.update({reaction.id: reaction for reaction in self.model.reactions})
+
     def initial_state(self):
         initial_fluxes = {}
         initial_solution = self.model.optimize()
         if initial_solution.status == 'optimal':
-            initial_fluxes = {
-                reaction.name: reaction.flux
-                for reaction in self.model.reactions
-            }
+            initial_fluxes = initial_solution.fluxes.to_dict()
 
         return {'fluxes': initial_fluxes}
 
@@ -90,26 +98,30 @@ class CobraProcess(Process):
         return {'fluxes': 'tree[float]'}
 
     def update(self, state, interval):
+        reactions = []
+        objective = {}
         for reaction_name, reaction_flux in state['reaction_fluxes'].items():
-            for reaction in self.model.reactions:
-                if reaction.name == reaction_name:
-                    # 1. reset objective weights according to reaction fluxes directly
-                    self.model.objective = {
-                        self.model.reactions.get_by_id(reaction.id): reaction_flux
-                    }
-
-                    # 2. set lower bound with scaling factor and reaction fluxes
-                    self.model.reactions.get_by_id(reaction.id).lower_bound = -self.scaling_factor * abs(reaction_flux)  # / (5 + abs(reaction_flux))
+            reaction = self.reaction_index.get(reaction_name)
+            if reaction is not None:
+                reactions.append((reaction, reaction_flux))
+                # 1. weight the objective according to reaction fluxes directly
+                objective[reaction] = reaction_flux
 
-        # 3. solve for fluxes
         output_state = {}
-        solution = self.model.optimize()
+        with self.model:
+            # 2. set lower bounds with scaling factor and reaction fluxes, all reverted when the context exits
+            if objective:
+                # keep the previous objective if no incoming flux matches a reaction
+                self.model.objective = objective
+            for reaction, reaction_flux in reactions:
+                reaction.lower_bound = -self.scaling_factor * abs(reaction_flux)  # / (5 + abs(reaction_flux))
+
+            # 3. solve for fluxes
+            solution = self.model.optimize()
+
         if solution.status == "optimal":
-            data = dict(zip(
-                list(state['reaction_fluxes'].keys()),
-                list(solution.fluxes.to_dict().values())
-            ))
-            output_state['fluxes'] = data
+            reaction_ids = [reaction.id for reaction, _ in reactions]
+            output_state['fluxes'] = dict(zip(reaction_ids, solution.fluxes.loc[reaction_ids].tolist()))
 
             # TODO: do we want to instead scale by input flux?
             # for reaction in self.model.reactions:
@@ -124,34 +136,68 @@ class CobraProcess(Process):
 # -- fully-spec'd Sed-compliant copasi process --
 
 class SedCobraProcess(Process):
-    config_schema = TimeCourseConfig
+    """
+    Solves a COBRA model at every step according to one of the following analysis modes:
+
+    - 'fba': flux balance analysis, outputting the fluxes and dual values keyed by reaction/metabolite id.
+    - 'pfba': parsimonious FBA, outputting the fluxes as an array.
+    - 'fva': flux variability analysis, outputting the minimum and maximum fluxes as arrays.
+
+    Parameters (in addition to the time course config):
+    - analysis: The analysis mode.
+    - reactions: Ids of the reactions to analyze and output, in array order. Defaults to every reaction of the model.
+        FVA is solved for these reactions only.
+    - fraction_of_optimum: Fraction of the optimal objective value which the pFBA and FVA solutions must attain.
+    - num_workers: Number of processes over which FVA is distributed. `cobra.flux_analysis.flux_variability_analysis`
+        starts a new multiprocessing pool at every call, and so at every update, which pays off only when the FVA
+        itself takes much longer than starting the workers and copying the model into them.
+    """
+    config_schema = {
+        **TimeCourseConfig,
+        'analysis': {
+            '_type': 'string',
+            '_default': 'fba'
+        },
+        'reactions': 'maybe[list[string]]',
+        'fraction_of_optimum': {
+            '_type': 'float',
+            '_default': 1.0
+        },
+        'num_workers': {
+            '_type': 'integer',
+            '_default': 1
+        },
+    }
+    analysis_modes = ['fba', 'pfba', 'fva']
 
     def __init__(self, config=None, core=None):
         super().__init__(config, core)
-        self.model = load_model(self.config['model']['model_source'])
+        self.model = COBRA_MODELS.get(self.config['model']['model_source'])
         self.reactions = self.model.reactions
         self.metabolites = self.model.metabolites
         self.objective = self.model.objective.to_json()['expression']['args'][0]['args'][1]['name']  # TODO -- fix this in cobra
         self.boundary = self.model.boundary
 
-    def initial_state(self):
-        solution = self.model.optimize()
-        optimized_fluxes = solution.fluxes
+        self.analysis = self.config.get('analysis', 'fba')
+        if self.analysis not in self.analysis_modes:
+            raise ValueError(f'"{self.analysis}" is not a valid analysis mode. Choose one of {self.analysis_modes}.')
+        self.reaction_ids = self.config.get('reactions') or [reaction.id for reaction in self.reactions]
+        self.fraction_of_optimum = self.config.get('fraction_of_optimum', 1.0)
+        self.num_workers = self.config.get('num_workers', 1)
 
+    def initial_state(self):
         state = {
             'inputs': {
                 'reaction_bounds': {}
             },
-            'outputs': {
-                'fluxes': {}
-            }
+            # the initial outputs follow the schema of the analysis mode
+            'outputs': self._run()
         }
         for reaction in self.model.reactions:
             state['inputs']['reaction_bounds'][reaction.id] = {
                 'lower_bound': reaction.lower_bound,
                 'upper_bound': reaction.upper_bound
             }
-            state['outputs']['fluxes'][reaction.id] = optimized_fluxes[reaction.id]
         return state
 
     def inputs(self):
@@ -166,14 +212,34 @@ class SedCobraProcess(Process):
             },
         }
 
+    def _reactions_array_type(self):
+        return {
+            '_type': 'array',
+            '_shape': (len(self.reaction_ids),),
+            '_data': 'float',
+            '_apply': 'set'
+        }
+
     def outputs(self):
+        if self.analysis == 'pfba':
+            return {
+                'fluxes': self._reactions_array_type(),
+                'objective_value': 'float',
+                'status': 'string',
+            }
+        elif self.analysis == 'fva':
+            return {
+                'minimum_fluxes': self._reactions_array_type(),
+                'maximum_fluxes': self._reactions_array_type(),
+            }
+
         return {
             'fluxes': {
-                reaction.id: 'float' for reaction in self.reactions
+                reaction_id: 'float' for reaction_id in self.reaction_ids
             },
             'objective_value': 'float',
             'reaction_dual_values': {
-                reaction.id: 'float' for reaction in self.reactions
+                reaction_id: 'float' for reaction_id in self.reaction_ids
             },
             'metabolite_dual_values': {
                 metabolite.id: 'float' for metabolite in self.metabolites
@@ -181,6 +247,26 @@ class SedCobraProcess(Process):
             'status': 'string',
         }
 
+    def _run_pfba(self):
+        solution = pfba(self.model, fraction_of_optimum=self.fraction_of_optimum, reactions=self.reaction_ids)
+        return {
+            'fluxes': solution.fluxes.loc[self.reaction_ids].to_numpy(),
+            'objective_value': solution.objective_value,
+            'status': solution.status,
+        }
+
+    def _run_fva(self):
+        ranges = flux_variability_analysis(
+            self.model,
+            reaction_list=self.reaction_ids,
+            fraction_of_optimum=self.fraction_of_optimum,
+            processes=self.num_workers)
+        ranges = ranges.loc[self.reaction_ids]
+        return {
+            'minimum_fluxes': ranges['minimum'].to_numpy(),
+            'maximum_fluxes': ranges['maximum'].to_numpy(),
+        }
+
     def update(self, inputs, interval):
         # set reaction bounds
         reaction_bounds = inputs['reaction_bounds']
@@ -191,13 +277,22 @@ class SedCobraProcess(Process):
         # TODO -- look into optlang for specifying objective and constraints
         self.model.objective = self.model.reactions.get_by_id(inputs['objective_reaction'])
 
-        # run solver
+        return self._run()
+
+    def _run(self):
+        if self.analysis == 'pfba':
+            return self._run_pfba()
+        elif self.analysis == 'fva':
+            return self._run_fva()
+        return self._run_fba()
+
+    def _run_fba(self):
         solution = self.model.optimize()
 
         return {
-            'fluxes': solution.fluxes.to_dict(),
+            'fluxes': solution.fluxes.loc[self.reaction_ids].to_dict(),
             'objective_value': solution.objective_value,
-            'reaction_dual_values': solution.reduced_costs.to_dict(),
+            'reaction_dual_values': solution.reduced_costs.loc[self.reaction_ids].to_dict(),
             'metabolite_dual_values': solution.shadow_prices.to_dict(),
             'status': solution.status,
         }
@@ -213,6 +308,14 @@ class DynamicFBA(Process):
     - biomass_reaction: The identifier for the biomass reaction in the model.
     - substrate_update_reactions: A dictionary mapping substrates to their update reactions.
     - biomass_identifier: The identifier for biomass in the current state.
+    - copy_model: Whether this process works on its own copy of the model, or shares the cached model with every other
+        process configured with the same model file.
+    - incremental_solve: Whether to re-solve the LP in place, changing only the modified bounds and reading only the
+        biomass and substrate exchange fluxes, rather than building a full solution at every step.
+    - cache_tolerance: If positive, reuse the fluxes solved for uptake bounds equal to the current ones when quantized
+        to this tolerance. The cache is shared by every process solving the same problem.
+    - cache_size: Maximum number of cached solutions.
+    - cache_error_bound: Maximum estimated flux error accepted on a cache hit (defaults to `cache_tolerance`).
 
     TODO -- check units
     """
@@ -228,21 +331,30 @@ class DynamicFBA(Process):
         'substrate_update_reactions': 'map[string]',
         'biomass_identifier': 'string',
         'bounds': 'map[bounds]',
+        'copy_model': {
+            '_type': 'boolean',
+            '_default': True
+        },
+        'incremental_solve': {
+            '_type': 'boolean',
+            '_default': True
+        },
+        'cache_tolerance': {
+            '_type': 'float',
+            '_default': 0.0
+        },
+        'cache_size': {
+            '_type': 'integer',
+            '_default': 1024
+        },
+        'cache_error_bound': 'maybe[float]',
     }
 
     def __init__(self, config, core):
         super().__init__(config, core)
 
-        if self.config['model_file'] == 'TESTING':
-            self.model = MODEL_FOR_TESTING
-        elif not 'xml' in self.config['model_file']:
-            # use the textbook model if no model file is provided
-            self.model = load_model(self.config['model_file'])
-        elif isinstance(self.config['model_file'], str):
-            self.model = cobra.io.read_sbml_model(self.config['model_file'])
-        else:
-            # error handling
-            raise ValueError('Invalid model file')
+        # 'TESTING' for the textbook model, a model name from the COBRA repositories or an SBML file path
+        self.model = COBRA_MODELS.get(self.config['model_file'], copy=self.config.get('copy_model', True))
 
         for reaction_id, bounds in self.config['bounds'].items():
             if bounds['lower'] is not None:
@@ -250,6 +362,25 @@ class DynamicFBA(Process):
             if bounds['upper'] is not None:
                 self.model.reactions.get_by_id(reaction_id).upper_bound = bounds['upper']
 
+        # the fluxes read at each step
+        self.flux_reactions = [self.config['biomass_reaction'], *self.config['substrate_update_reactions'].values()]
+        self.incremental_fba = IncrementalFBA(self.model, self.flux_reactions) \
+            if self.config.get('incremental_solve', True) else None
+
+        # optional solution cache, shared with the processes solving the same problem
+        self.solution_cache = None
+        if self.config.get('cache_tolerance'):
+            problem = {
+                'model_file': self.config['model_file'],
+                'biomass_reaction': self.config['biomass_reaction'],
+                'substrate_update_reactions': self.config['substrate_update_reactions'],
+                'bounds': self.config['bounds']}
+            self.solution_cache = get_solution_cache(
+                problem,
+                tolerance=self.config['cache_tolerance'],
+                max_size=self.config.get('cache_size', 1024),
+                error_bound=self.config.get('cache_error_bound'))
+
     def inputs(self):
         return {
             'substrates': 'map[positive_float]'
@@ -260,26 +391,50 @@ class DynamicFBA(Process):
             'substrates': 'map[positive_float]'
         }
 
+    def _solve(self, lower_bounds):
+        if self.solution_cache is not None:
+            fluxes = self.solution_cache.get(lower_bounds)
+            if fluxes is not None:
+                return fluxes
+
+        if self.incremental_fba is not None:
+            self.incremental_fba.set_lower_bounds(lower_bounds)
+            fluxes = self.incremental_fba.solve()
+        else:
+            for reaction_id, lower_bound in lower_bounds.items():
+                self.model.reactions.get_by_id(reaction_id).lower_bound = lower_bound
+            solution = self.model.optimize()
+            fluxes = {reaction_id: solution.fluxes[reaction_id] for reaction_id in self.flux_reactions} \
+                if solution.status == 'optimal' else None
+
+        if fluxes is not None and self.solution_cache is not None:
+            reduced_costs = {
+                reaction_id: self.model.reactions.get_by_id(reaction_id).reduced_cost
+                for reaction_id in lower_bounds}
+            self.solution_cache.put(lower_bounds, fluxes, reduced_costs)
+        return fluxes
+
     # TODO -- can we just put the inputs/outputs directly in the function?
     def update(self, state, interval):
         substrates_input = state['substrates']
 
+        lower_bounds = {}
         for substrate, reaction_id in self.config['substrate_update_reactions'].items():
             Km, Vmax = self.config['kinetic_params'][substrate]
             substrate_concentration = substrates_input[substrate]
             uptake_rate = Vmax * substrate_concentration / (Km + substrate_concentration)
-            self.model.reactions.get_by_id(reaction_id).lower_bound = -uptake_rate
+            lower_bounds[reaction_id] = -uptake_rate
 
         substrate_update = {}
 
-        solution = self.model.optimize()
-        if solution.status == 'optimal':
+        fluxes = self._solve(lower_bounds)
+        if fluxes is not None:
             current_biomass = substrates_input[self.config['biomass_identifier']]
-            biomass_growth_rate = solution.fluxes[self.config['biomass_reaction']]
+            biomass_growth_rate = fluxes[self.config['biomass_reaction']]
             substrate_update[self.config['biomass_identifier']] = biomass_growth_rate * current_biomass * interval
 
             for substrate, reaction_id in self.config['substrate_update_reactions'].items():
-                flux = solution.fluxes[reaction_id] * current_biomass * interval
+                flux = fluxes[reaction_id] * current_biomass * interval
                 old_concentration = substrates_input[substrate]
                 new_concentration = max(old_concentration + flux, 0)  # keep above 0
                 substrate_update[substrate] = new_concentration - old_concentration
@@ -295,6 +450,162 @@ class DynamicFBA(Process):
         }
 
 
+class SpatialDynamicFBA(DynamicFBA):
+    """
+    Performs dynamic FBA over every bin of a 2D grid within a single process.
+
+    Takes the same parameters as `DynamicFBA`, plus:
+    - n_bins: Shape of the grid, which is the shape of every array in `fields`.
+    - num_workers: If greater than 1, the LPs are solved by a `ParallelFBAPool` of this many worker processes, each
+        handling a contiguous shard of bins. The workers honor `incremental_solve`, and the rows found in the solution
+        cache are not sent to them. The pool is released by `close`, or when the process is garbage collected.
+
+    Rather than one `DynamicFBA` node per bin, this process reads the whole `fields` arrays, evaluates the
+    Michaelis-Menten uptake rates of every bin at once and solves one LP per distinct row of uptake bounds. When
+    `cache_tolerance` is set, bins whose bounds are equal once quantized to it share a solution. The updates of all
+    bins are written back as whole arrays.
+    """
+
+    config_schema = {
+        **DynamicFBA.config_schema,
+        'n_bins': {
+            '_type': 'tuple[integer,integer]',
+            '_default': (5, 5)
+        },
+        'num_workers': {
+            '_type': 'integer',
+            '_default': 0
+        },
+    }
+
+    def __init__(self, config, core):
+        super().__init__(config, core)
+        self.n_bins = tuple(self.config['n_bins'])
+        self.substrates = list(self.config['substrate_update_reactions'].keys())
+        self.exchange_reactions = list(self.config['substrate_update_reactions'].values())
+        kinetic_params = np.array([self.config['kinetic_params'][substrate] for substrate in self.substrates], dtype=float)
+        self.Km = kinetic_params[:, 0]
+        self.Vmax = kinetic_params[:, 1]
+
+        self.pool = None
+        if self.config.get('num_workers', 0) > 1:
+            self.pool = ParallelFBAPool(
+                model_file=self.config['model_file'],
+                biomass_reaction=self.config['biomass_reaction'],
+                exchange_reactions=self.exchange_reactions,
+                bounds=self.config['bounds'],
+                num_workers=self.config['num_workers'],
+                incremental_solve=self.config.get('incremental_solve', True))
+
+    def close(self) -> None:
+        """Shut down the worker processes and release their shared memory, if any."""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+    def _fields_type(self):
+        return {
+            '_type': 'map',
+            '_value': {
+                '_type': 'array',
+                '_shape': self.n_bins,
+                '_data': 'positive_float'
+            }
+        }
+
+    def inputs(self):
+        return {
+            'fields': self._fields_type()
+        }
+
+    def outputs(self):
+        return {
+            'fields': self._fields_type()
+        }
+
+    def solve_bounds(self, lower_bounds: np.ndarray):
+        """Solve the LP for every row of `lower_bounds` (bins × substrates) once per distinct row, returning the
+            growth rates (bins) and the exchange fluxes (bins × substrates). Infeasible bins get zero fluxes.
+
+            When `cache_tolerance` is set, rows are grouped by their bounds quantized to it, and each group is solved
+            at the exact bounds of one of its bins, which are also those checked against `cache_error_bound` by the
+            solution cache.
+        """
+        tolerance = self.config.get('cache_tolerance')
+        keys = np.round(lower_bounds / tolerance) if tolerance else lower_bounds
+
+        _, representatives, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+        unique_bounds = lower_bounds[representatives]
+        inverse = inverse.reshape(-1)
+
+        growth_rates = np.zeros(len(unique_bounds))
+        exchange_fluxes = np.zeros(unique_bounds.shape)
+        if self.pool is not None:
+            self._solve_pool(unique_bounds, growth_rates, exchange_fluxes)
+        else:
+            for i, bounds in enumerate(unique_bounds):
+                fluxes = self._solve(dict(zip(self.exchange_reactions, bounds.tolist())))
+                if fluxes is not None:
+                    growth_rates[i] = fluxes[self.config['biomass_reaction']]
+                    exchange_fluxes[i] = [fluxes[reaction_id] for reaction_id in self.exchange_reactions]
+
+        return growth_rates[inverse], exchange_fluxes[inverse]
+
+    def _solve_pool(self, unique_bounds: np.ndarray, growth_rates: np.ndarray, exchange_fluxes: np.ndarray) -> None:
+        """Fill the solutions of the rows of `unique_bounds` from the solution cache, and solve the others with the
+            pool, caching their solutions.
+        """
+        biomass_reaction = self.config['biomass_reaction']
+        pending = []
+        for i, bounds in enumerate(unique_bounds):
+            fluxes = None
+            if self.solution_cache is not None:
+                fluxes = self.solution_cache.get(dict(zip(self.exchange_reactions, bounds.tolist())))
+            if fluxes is None:
+                pending.append(i)
+            else:
+                growth_rates[i] = fluxes[biomass_reaction]
+                exchange_fluxes[i] = [fluxes[reaction_id] for reaction_id in self.exchange_reactions]
+        if not pending:
+            return
+
+        results = self.pool.solve(unique_bounds[pending])
+        growth_rates[pending] = results.growth_rates
+        exchange_fluxes[pending] = results.exchange_fluxes
+        if self.solution_cache is not None:
+            for j, i in enumerate(pending):
+                if results.feasible[j]:
+                    self.solution_cache.put(
+                        dict(zip(self.exchange_reactions, unique_bounds[i].tolist())),
+                        {biomass_reaction: float(results.growth_rates[j]),
+                         **dict(zip(self.exchange_reactions, results.exchange_fluxes[j].tolist()))},
+                        dict(zip(self.exchange_reactions, results.reduced_costs[j].tolist())))
+
+    def update(self, state, interval):
+        fields = state['fields']
+        biomass_identifier = self.config['biomass_identifier']
+
+        # concentrations of every bin, shaped (bins, substrates)
+        concentrations = np.stack(
+            [np.asarray(fields[substrate], dtype=float).reshape(-1) for substrate in self.substrates], axis=1)
+        biomass = np.asarray(fields[biomass_identifier], dtype=float).reshape(-1)
+
+        uptake_rates = self.Vmax * concentrations / (self.Km + concentrations)
+        growth_rates, exchange_fluxes = self.solve_bounds(-uptake_rates)
+
+        new_concentrations = np.maximum(concentrations + exchange_fluxes * biomass[:, None] * interval, 0)  # keep above 0
+        substrate_update = new_concentrations - concentrations
+
+        fields_update = {
+            substrate: substrate_update[:, i].reshape(self.n_bins)
+            for i, substrate in enumerate(self.substrates)}
+        fields_update[biomass_identifier] = (growth_rates * biomass * interval).reshape(self.n_bins)
+
+        return {
+            'fields': fields_update,
+        }
+
+
 # register the process
 # CORE.register_process('DynamicFBA', DynamicFBA)
 
@@ -385,10 +696,29 @@ def get_spatial_dfba_spec(n_bins=(5, 5), mol_ids=None):
     return dfba_processes_dict
 
 
+def get_spatial_dfba_process_spec(n_bins=(5, 5), path=None, num_workers=0, **config):
+    """Specification of a single `SpatialDynamicFBA` process reading and updating the whole `fields` arrays."""
+    if path is None:
+        path = ['fields']
+    return {
+        '_type': 'process',
+        'address': 'local:spatial-dynamic-fba',
+        'config': {**dfba_config(**config), 'n_bins': tuple(n_bins), 'num_workers': num_workers},
+        'inputs': {
+            'fields': path
+        },
+        'outputs': {
+            'fields': path
+        }
+    }
+
+
 def get_spatial_dfba_state(
         n_bins=(5, 5),
         mol_ids=None,
         initial_max=None,
+        vectorized=False,
+        diffusion=None,
 ):
     if mol_ids is None:
         mol_ids = ['glucose', 'acetate', 'biomass']
@@ -405,7 +735,7 @@ def get_spatial_dfba_state(
         mol_id: np.random.uniform(low=0, high=initial_max[mol_id], size=n_bins)
         for mol_id in mol_ids}
 
-    return {
+    state = {
         'fields': {
             '_type': 'map',
             '_value': {
@@ -415,21 +745,29 @@ def get_spatial_dfba_state(
             },
             **initial_fields,
         },
-        'spatial_dfba': get_spatial_dfba_spec(n_bins=n_bins, mol_ids=mol_ids)
+        'spatial_dfba': get_spatial_dfba_process_spec(n_bins=n_bins) if vectorized
+        else get_spatial_dfba_spec(n_bins=n_bins, mol_ids=mol_ids)
     }
+    if diffusion is not None:
+        # imported here so that the COBRA processes do not require scipy
+        from bsp.processes.field_transport_process import get_field_transport_spec
+        state['field_transport'] = get_field_transport_spec(n_bins=n_bins, diffusion=diffusion)
+    return state
 
 
 def run_dfba_spatial(
         total_time=60,
         n_bins=(3, 3),  # TODO -- why can't do (5, 10)??
         mol_ids=None,
-        CORE=None
+        CORE=None,
+        vectorized=False
 ):
     if mol_ids is None:
         mol_ids = ['glucose', 'acetate', 'biomass']
     composite_state = get_spatial_dfba_state(
         n_bins=n_bins,
         mol_ids=mol_ids,
+        vectorized=vectorized,
     )
     # make the composite
     print('Making the composite...')
@@ -1,8 +1,8 @@
 from typing import Dict, Union, Optional
 
+import numpy as np
 from pandas import DataFrame
 from basico import (
-    load_model,
     get_species,
     get_parameters,
     get_reactions,
@@ -21,6 +21,7 @@ from process_bigraph import Process
 from bsp.data_model.sed import SedModel
 from bsp.schemas.config import TimeCourseConfig
 from bsp.utils.helpers import fetch_biomodel
+from bsp.utils.copasi_utils import CopasiStateExchange, CopasiTimeCourseEngine, load_cached_model
 from bsp.processes.sed_process import SedUTCProcess
 
 
@@ -32,20 +33,19 @@ class CopasiProcess(Process):
 
     def __init__(self, config=None, core=None):
         super().__init__(config, core)
-        self.model = load_model(self.config['model']['model_source'])
+        self.model = load_cached_model(self.config['model']['model_source'])
         self.reaction_names = get_reactions(model=self.model).index.tolist()
         self.species_names = get_species(model=self.model).index.tolist()
 
+        # resolve species/reaction object references once for bulk io in update
+        self.state_exchange = CopasiStateExchange(self.model, self.species_names, self.reaction_names)
+
     def initial_state(self):
-        initial_concentrations = {
-            species_name: get_species(species_name, model=self.model).initial_concentration[0]
-            for species_name in self.species_names
-        }
+        initial_concentrations = self.state_exchange.species_dict(
+            self.state_exchange.get_initial_concentrations())
 
-        initial_derivatives = {
-            rxn_id: get_reactions(rxn_id, model=self.model).flux[0]
-            for rxn_id in self.reaction_names
-        }
+        initial_derivatives = self.state_exchange.reactions_dict(
+            self.state_exchange.get_fluxes())
 
         return {
             'species_concentrations': initial_concentrations,
@@ -83,15 +83,7 @@ class CopasiProcess(Process):
     def update(self, inputs, interval):
         # spec_data_k = inputs['species_concentrations']
         spec_data_k = inputs['species_counts']
-        for cat_id, value in spec_data_k.items():
-            # set_type = 'concentration'
-            set_type = "count"
-            species_config = {
-                'name': cat_id,
-                'model': self.model,
-                set_type: value
-            }
-            set_species(**species_config)
+        self.state_exchange.set_species_values(spec_data_k, use_counts=True)
 
         # run model for "interval" length; we only want the state at the end
         tc = run_time_course(
@@ -102,22 +94,10 @@ class CopasiProcess(Process):
         )
 
         results = {'time': interval}
-        results['species_concentrations'] = {
-            mol_id: float(get_species(
-                name=mol_id,
-                exact=True,
-                model=self.model
-            ).concentration[0])
-            for mol_id in self.species_names
-        }
-
-        results['reaction_fluxes'] = {
-            rxn_id: float(get_reactions(
-                name=rxn_id,
-                model=self.model
-            ).flux[0])
-            for rxn_id in self.reaction_names
-        }
+        results['species_concentrations'] = self.state_exchange.species_dict(
+            self.state_exchange.get_concentrations())
+        results['reaction_fluxes'] = self.state_exchange.reactions_dict(
+            self.state_exchange.get_fluxes())
 
         return results
 
@@ -130,20 +110,19 @@ class _CopasiProcess(Process):
 
     def __init__(self, config=None, core=None):
         super().__init__(config, core)
-        self.model = load_model(self.config['model']['model_source'])
+        self.model = load_cached_model(self.config['model']['model_source'])
         self.reaction_names = get_reactions(model=self.model).index.tolist()
         self.species_names = get_species(model=self.model).index.tolist()
 
+        # resolve species/reaction object references once for bulk io in update
+        self.state_exchange = CopasiStateExchange(self.model, self.species_names, self.reaction_names)
+
     def initial_state(self):
-        initial_concentrations = {
-            species_name: get_species(species_name, model=self.model).initial_concentration[0]
-            for species_name in self.species_names
-        }
+        initial_concentrations = self.state_exchange.species_dict(
+            self.state_exchange.get_initial_concentrations())
 
-        initial_derivatives = {
-            rxn_id: get_reactions(rxn_id, model=self.model).flux[0]
-            for rxn_id in self.reaction_names
-        }
+        initial_derivatives = self.state_exchange.reactions_dict(
+            self.state_exchange.get_fluxes())
 
         return {
             'species_concentrations': initial_concentrations,
@@ -181,15 +160,7 @@ class _CopasiProcess(Process):
     def update(self, inputs, interval):
         # spec_data_k = inputs['species_concentrations']
         spec_data_k = inputs['species_counts']
-        for cat_id, value in spec_data_k.items():
-            # set_type = 'concentration'
-            set_type = "count"
-            species_config = {
-                'name': cat_id,
-                'model': self.model,
-                set_type: value
-            }
-            set_species(**species_config)
+        self.state_exchange.set_species_values(spec_data_k, use_counts=True)
 
         # run model for "interval" length; we only want the state at the end
         tc = run_time_course(
@@ -200,22 +171,10 @@ class _CopasiProcess(Process):
         )
 
         results = {'time': interval}
-        results['species_concentrations'] = {
-            mol_id: float(get_species(
-                name=mol_id,
-                exact=True,
-                model=self.model
-            ).concentration[0])
-            for mol_id in self.species_names
-        }
-
-        results['reaction_fluxes'] = {
-            rxn_id: float(get_reactions(
-                name=rxn_id,
-                model=self.model
-            ).flux[0])
-            for rxn_id in self.reaction_names
-        }
+        results['species_concentrations'] = self.state_exchange.species_dict(
+            self.state_exchange.get_concentrations())
+        results['reaction_fluxes'] = self.state_exchange.reactions_dict(
+            self.state_exchange.get_fluxes())
 
         return results
 
@@ -223,7 +182,23 @@ class _CopasiProcess(Process):
 # -- fully-spec'd Sed-compliant copasi process --
 
 class SedCopasiProcess(SedUTCProcess):
-    config_schema = TimeCourseConfig
+    config_schema = {
+        **TimeCourseConfig,
+        'method': {
+            '_type': 'string',
+            '_default': 'deterministic'
+        },
+        # keep one configured COPASI trajectory task alive across update intervals
+        'persistent_task': {
+            '_type': 'boolean',
+            '_default': False
+        },
+        # emit per-step setup vs. integration timings of the persistent task on the `step_timings` port
+        'report_timings': {
+            '_type': 'boolean',
+            '_default': False
+        }
+    }
 
     def __init__(self,
                  config: Dict = None,
@@ -236,9 +211,14 @@ class SedCopasiProcess(SedUTCProcess):
         model_changes = self.config['model'].get('model_changes', {})
         self.model_changes = {} if model_changes is None else model_changes
 
-        # Option A:
+        # Option A: (model changes are part of the cache entry and are only applied on a cache miss)
+        self._model_changes_applied = False
         if '/' in model_source:
-            self.copasi_model_object = load_model(model_source)
+            self.copasi_model_object = load_cached_model(
+                model_source,
+                model_changes=self.model_changes,
+                on_load=self._apply_model_changes)
+            self._model_changes_applied = True
             print('found a filepath')
 
         # Option B:
@@ -261,35 +241,53 @@ class SedCopasiProcess(SedUTCProcess):
         # handle context of species output
         context_type = self.config['species_context']
         self.species_context_key = f'floating_species_{context_type}'
-        self.use_counts = 'concentrations' in context_type
+        self.use_counts = 'counts' in context_type
 
         # Get a list of reactions
-        self._set_reaction_changes()
+        if not self._model_changes_applied:
+            self._set_reaction_changes()
         reactions = get_reactions(model=self.copasi_model_object)
         self.reaction_list = reactions.index.tolist() if reactions is not None else []
         # if not self.reaction_list:
         # raise AttributeError('No reactions could be parsed from this model. Your model must contain reactions to run.')
 
         # Get the species (floating only)  TODO: add boundary species
-        self._set_species_changes()
+        if not self._model_changes_applied:
+            self._set_species_changes()
         species_data = get_species(model=self.copasi_model_object)
         self.floating_species_list = species_data.index.tolist()
         self.floating_species_initial = species_data.particle_number.tolist() \
             if self.use_counts else species_data.concentration.tolist()
 
         # Get the list of parameters and their values (it is possible to run a model without any parameters)
-        self._set_global_param_changes()
+        if not self._model_changes_applied:
+            self._set_global_param_changes()
         model_parameters = get_parameters(model=self.copasi_model_object)
         self.model_parameters_list = model_parameters.index.tolist() \
             if isinstance(model_parameters, DataFrame) else []
         self.model_parameters_values = model_parameters.initial_value.tolist() \
             if isinstance(model_parameters, DataFrame) else []
 
+        # resolve species/reaction/parameter object references once for bulk io in update
+        self.state_exchange = CopasiStateExchange(
+            self.copasi_model_object,
+            species_names=self.floating_species_list,
+            reaction_names=self.reaction_list,
+            parameter_names=self.model_parameters_list)
+
         # Get a list of compartments
         self.compartments_list = get_compartments(model=self.copasi_model_object).index.tolist()
 
         # ----SOLVER: Get the solver (defaults to deterministic)
         self.method = self.config['method']
+        self.engine = None
+        if self.config.get('persistent_task'):
+            self.engine = CopasiTimeCourseEngine(
+                model=self.copasi_model_object,
+                state_exchange=self.state_exchange,
+                method=self.method,
+                use_counts=self.use_counts)
+        self.report_timings = self.engine is not None and self.config.get('report_timings', False)
 
     def initial_state(self):
         # keep in mind that a valid simulation may not have global parameters
@@ -339,49 +337,49 @@ class SedCopasiProcess(SedUTCProcess):
                 '_apply': 'set'}
             for species_id in self.floating_species_list
         }
-        return {
+        output_schema = {
             'time': 'float',
             self.species_context_key: floating_species_type}
+        if self.report_timings:
+            output_schema['step_timings'] = {
+                'setup': {'_type': 'float', '_apply': 'set'},
+                'integration': {'_type': 'float', '_apply': 'set'}}
+
+        return output_schema
 
     def update(self, inputs, interval):
-        # set copasi values according to what is passed in states for concentrations
-        for cat_id, value in inputs[self.species_context_key].items():
-            set_type = 'particle_number' if 'counts' in self.species_context_key else 'concentration'
-            species_config = {
-                'name': cat_id,
-                'model': self.copasi_model_object,
-                set_type: value}
-            set_species(**species_config)
+        results = {'time': interval}
+        if self.engine is not None:
+            # apply only the state deltas and advance the already configured task
+            self.engine.apply_state(inputs[self.species_context_key])
+            timing = self.engine.advance(start_time=inputs['time'], interval=interval)
+            if self.report_timings:
+                results['step_timings'] = timing
+        else:
+            # set copasi values according to what is passed in states for concentrations
+            self.state_exchange.set_species_values(inputs[self.species_context_key], use_counts=self.use_counts)
 
-        # run model for "interval" length; we only want the state at the end
-        timecourse = run_time_course(
-            start_time=inputs['time'],
-            duration=interval,
-            update_model=True,
-            model=self.copasi_model_object,
-            method=self.method)
+            # run model for "interval" length; we only want the state at the end
+            timecourse = run_time_course(
+                start_time=inputs['time'],
+                duration=interval,
+                update_model=True,
+                model=self.copasi_model_object,
+                method=self.method)
 
         # extract end values of concentrations from the model and set them in results
-        results = {'time': interval}
-        if self.use_counts:
-            results[self.species_context_key] = {
-                mol_id: float(get_species(
-                    name=mol_id,
-                    exact=True,
-                    model=self.copasi_model_object
-                ).particle_number[0])
-                for mol_id in self.floating_species_list}
-        else:
-            results[self.species_context_key] = {
-                mol_id: float(get_species(
-                    name=mol_id,
-                    exact=True,
-                    model=self.copasi_model_object
-                ).concentration[0])
-                for mol_id in self.floating_species_list}
+        end_state = self.engine.get_state() if self.engine is not None \
+            else self.state_exchange.get_state(use_counts=self.use_counts)
+        results[self.species_context_key] = self.state_exchange.species_dict(end_state)
 
         return results
 
+    def _apply_model_changes(self, model):
+        self.copasi_model_object = model
+        self._set_reaction_changes()
+        self._set_species_changes()
+        self._set_global_param_changes()
+
     def _set_reaction_changes(self):
         # ----REACTIONS: set reactions
         existing_reactions = get_reactions(model=self.copasi_model_object)
@@ -433,3 +431,112 @@ class SedCopasiProcess(SedUTCProcess):
                         if param_name not in existing_global_parameters:
                             assert param_change.get('initial_concentration') is not None, "You must pass an initial_concentration value if adding a new global parameter."
                             add_parameter(name=param_name, **param_change, model=self.copasi_model_object)
+
+
+class SedCopasiEnsembleProcess(SedCopasiProcess):
+    """Advance an ensemble of perturbed copies of one model within a single process.
+
+        The model is parsed once and the reaction/species lists and port schemas are shared across members. Each
+        member is a row of `ensemble_values`, whose columns are the species (initial conditions) and/or global
+        parameters named in `ensemble_keys`. Member states are exchanged as a single (ensemble x species) array on
+        the `ensemble_<species_context_key>` port rather than as one dict tree per member.
+
+        COPASI has no batched integrator, so the members are advanced one after the other on the shared model. The
+        full state of each member (every species, global quantity and compartment size) is kept between updates and
+        restored into the model before the member is advanced, so that no member inherits the changes made by the
+        previous one.
+    """
+    config_schema = {
+        **SedCopasiProcess.config_schema,
+        'ensemble_keys': 'list[string]',
+        'ensemble_values': 'list[list[float]]'
+    }
+
+    def __init__(self, config: Dict = None, core: Dict = None):
+        super().__init__(config, core)
+        self.ensemble_key = f'ensemble_{self.species_context_key}'
+        self.ensemble_keys = self.config['ensemble_keys']
+        ensemble_values = np.array(self.config['ensemble_values'], dtype=float, ndmin=2)
+        assert ensemble_values.shape[1] == len(self.ensemble_keys), \
+            'Each row of ensemble_values must hold one value per entry of ensemble_keys.'
+        self.ensemble_size = ensemble_values.shape[0]
+
+        # split the ensemble columns into initial conditions and global parameters
+        species_columns = [i for i, key in enumerate(self.ensemble_keys) if key in self.state_exchange.species_index]
+        parameter_columns = [i for i, key in enumerate(self.ensemble_keys) if key in self.state_exchange.parameter_index]
+        unknown_keys = set(self.ensemble_keys) - set(self.state_exchange.species_index) - set(self.state_exchange.parameter_index)
+        if unknown_keys:
+            raise ValueError(f'The following ensemble keys are neither species nor global parameters: {unknown_keys}')
+
+        initial_state = np.array(self.floating_species_initial, dtype=float)
+        self.ensemble_state = np.tile(initial_state, (self.ensemble_size, 1))
+        species_indices = [self.state_exchange.species_index[self.ensemble_keys[i]] for i in species_columns]
+        self.ensemble_state[:, species_indices] = ensemble_values[:, species_columns]
+
+        self.parameter_indices = [self.state_exchange.parameter_index[self.ensemble_keys[i]] for i in parameter_columns]
+        self.ensemble_parameters = ensemble_values[:, parameter_columns]
+
+        # full model state of each member, restored before the member is advanced
+        self.member_entities = np.tile(self.state_exchange.get_initial_entity_values(), (self.ensemble_size, 1))
+
+    def initial_state(self):
+        return {
+            'time': 0.0,
+            self.ensemble_key: self.ensemble_state.copy()
+        }
+
+    def _ensemble_type(self):
+        return {
+            '_type': 'array',
+            '_shape': (self.ensemble_size, len(self.floating_species_list)),
+            '_data': 'float',
+            '_apply': 'set'
+        }
+
+    def inputs(self):
+        return {
+            'time': 'float',
+            self.ensemble_key: self._ensemble_type()
+        }
+
+    def outputs(self):
+        return {
+            'time': 'float',
+            self.ensemble_key: self._ensemble_type()
+        }
+
+    def update(self, inputs, interval):
+        member_states = inputs.get(self.ensemble_key)
+        if member_states is not None:
+            self.ensemble_state = np.array(member_states, dtype=float)
+
+        start_time = inputs['time']
+        for member in range(self.ensemble_size):
+            # load the member into the shared model: its full state, then the species of the port
+            self.state_exchange.set_initial_entity_values(self.member_entities[member])
+            self.state_exchange.set_initial_state(self.ensemble_state[member], use_counts=self.use_counts)
+            if self.parameter_indices:
+                self.state_exchange.set_initial_parameter_values(
+                    self.ensemble_parameters[member],
+                    indices=self.parameter_indices)
+
+            if self.engine is not None:
+                self.engine.require_restart()
+                self.engine.advance(start_time=start_time, interval=interval)
+                end_state = self.engine.get_state()
+            else:
+                run_time_course(
+                    start_time=start_time,
+                    duration=interval,
+                    update_model=True,
+                    model=self.copasi_model_object,
+                    method=self.method)
+                end_state = self.state_exchange.get_state(use_counts=self.use_counts)
+
+            self.ensemble_state[member] = end_state
+            self.member_entities[member] = self.state_exchange.get_entity_values()
+
+        return {
+            'time': interval,
+            self.ensemble_key: self.ensemble_state.copy()
+        }
@@ -0,0 +1,199 @@
+"""
+Field transport
+===============
+
+Process for diffusion and advection of the 2D concentration `fields` of a spatial dFBA composite.
+"""
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import factorized
+from process_bigraph import Process
+
+
+def neumann_laplacian(n_bins: Tuple[int, int], bin_size: Tuple[float, float]) -> sparse.csc_matrix:
+    """Five-point finite-difference Laplacian over a grid of shape `n_bins`, flattened in C order, with zero-flux
+        (Neumann) boundaries.
+    """
+    def second_difference(n: int, h: float) -> sparse.csr_matrix:
+        if n == 1:
+            return sparse.csr_matrix((1, 1))
+        main = -2.0 * np.ones(n)
+        main[0] = main[-1] = -1.0
+        off = np.ones(n - 1)
+        return sparse.diags([off, main, off], [-1, 0, 1], format='csr') / h ** 2
+
+    n_x, n_y = n_bins
+    dx, dy = bin_size
+    return (
+        sparse.kron(second_difference(n_x, dx), sparse.identity(n_y))
+        + sparse.kron(sparse.identity(n_x), second_difference(n_y, dy))
+    ).tocsc()
+
+
+def upwind_advection(field: np.ndarray, velocity: Tuple[float, float], bin_size: Tuple[float, float]) -> np.ndarray:
+    """Rate of change of `field` under first-order upwind advection at a uniform `velocity`, with no flux through the
+        boundaries, so that the total amount is conserved.
+    """
+    rate = np.zeros_like(field)
+    for axis, (v, h) in enumerate(zip(velocity, bin_size)):
+        if v == 0 or field.shape[axis] == 1:
+            continue
+        lower = np.take(field, np.arange(field.shape[axis] - 1), axis=axis)
+        upper = np.take(field, np.arange(1, field.shape[axis]), axis=axis)
+        flux = v * (lower if v > 0 else upper) / h
+
+        # flux across the interior faces leaves the lower bin and enters the upper bin
+        leaving = [slice(None)] * field.ndim
+        entering = [slice(None)] * field.ndim
+        leaving[axis] = slice(0, -1)
+        entering[axis] = slice(1, None)
+        rate[tuple(leaving)] -= flux
+        rate[tuple(entering)] += flux
+    return rate
+
+
+def advect(
+        field: np.ndarray,
+        velocity: Tuple[float, float],
+        bin_size: Tuple[float, float],
+        interval: float,
+        cfl: float = 0.9
+) -> np.ndarray:
+    """Advect `field` over `interval` with explicit upwind sub-steps. An explicit step in several dimensions is stable
+        and keeps the field non-negative only if the Courant numbers summed over the axes stay below 1, so the number
+        of sub-steps bounds that sum by `cfl`.
+    """
+    total_rate = sum(abs(v) / h for v, h in zip(velocity, bin_size))
+    if total_rate == 0:
+        return field
+    n_substeps = int(np.ceil(interval * total_rate / cfl))
+    dt = interval / n_substeps
+    for _ in range(n_substeps):
+        field = field + dt * upwind_advection(field, velocity, bin_size)
+    return field
+
+
+class FieldTransport(Process):
+    """
+    Diffuses and advects every array of `fields`.
+
+    Parameters:
+    - n_bins: Shape of the grid, which is the shape of every array in `fields`.
+    - bounds: Physical size of the grid along each axis. Defaults to one unit per bin.
+    - diffusion: Diffusion coefficient of each field. Fields without one are not diffused.
+    - advection: Uniform velocity of each field along each axis. Fields without one are not advected.
+    - cfl: Bound on the sum over the axes of the Courant numbers of each advection sub-step.
+
+    Diffusion is integrated with implicit Euler, which is unconditionally stable, so stiff coefficients on fine grids
+    do not force small steps. The operator `I - dt * D * L` is factorized once per field and interval and reused at
+    every update with the same interval, only the solvers of the latest interval being kept. Advection is integrated with
+    explicit first-order upwind differences, sub-stepped so that the sum of the Courant numbers over the axes stays
+    below `cfl`.
+    """
+
+    config_schema = {
+        'n_bins': {
+            '_type': 'tuple[integer,integer]',
+            '_default': (5, 5)
+        },
+        'bounds': 'maybe[tuple[float,float]]',
+        'diffusion': 'map[float]',
+        'advection': 'map[tuple[float,float]]',
+        'cfl': {
+            '_type': 'float',
+            '_default': 0.9
+        },
+    }
+
+    def __init__(self, config=None, core=None):
+        super().__init__(config, core)
+        self.n_bins = tuple(self.config['n_bins'])
+        bounds = self.config.get('bounds') or self.n_bins
+        self.bin_size = tuple(float(length) / n for length, n in zip(bounds, self.n_bins))
+        self.diffusion = self.config.get('diffusion') or {}
+        self.advection = {
+            mol_id: tuple(velocity)
+            for mol_id, velocity in (self.config.get('advection') or {}).items()}
+
+        self.laplacian = neumann_laplacian(self.n_bins, self.bin_size)
+        self._solvers: Dict[str, callable] = {}
+        self._solver_interval: Optional[float] = None
+
+    def _fields_type(self):
+        return {
+            '_type': 'map',
+            '_value': {
+                '_type': 'array',
+                '_shape': self.n_bins,
+                '_data': 'positive_float'
+            }
+        }
+
+    def inputs(self):
+        return {
+            'fields': self._fields_type()
+        }
+
+    def outputs(self):
+        return {
+            'fields': self._fields_type()
+        }
+
+    def diffusion_solver(self, mol_id: str, interval: float):
+        """Return the prefactorized implicit Euler solve for the diffusion of `mol_id` over `interval`."""
+        if interval != self._solver_interval:
+            # keep the solvers of one interval only, at most one per field
+            self._solvers = {}
+            self._solver_interval = interval
+        solve = self._solvers.get(mol_id)
+        if solve is None:
+            n = self.laplacian.shape[0]
+            operator = sparse.identity(n, format='csc') - interval * self.diffusion[mol_id] * self.laplacian
+            solve = self._solvers[mol_id] = factorized(operator.tocsc())
+        return solve
+
+    def advect(self, field: np.ndarray, velocity: Tuple[float, float], interval: float) -> np.ndarray:
+        return advect(field, velocity, self.bin_size, interval, self.config['cfl'])
+
+    def update(self, state, interval):
+        fields_update = {}
+        for mol_id, field in state['fields'].items():
+            field = np.asarray(field, dtype=float)
+            new_field = field
+            if mol_id in self.advection:
+                new_field = self.advect(new_field, self.advection[mol_id], interval)
+            if self.diffusion.get(mol_id):
+                new_field = self.diffusion_solver(mol_id, interval)(new_field.reshape(-1)).reshape(self.n_bins)
+            fields_update[mol_id] = np.maximum(new_field, 0) - field  # keep above 0
+
+        return {
+            'fields': fields_update
+        }
+
+
+def get_field_transport_spec(n_bins=(5, 5), bounds=None, diffusion=None, advection=None, path=None):
+    """Specification of a `FieldTransport` process acting on the `fields` of `get_spatial_dfba_state`."""
+    if path is None:
+        path = ['fields']
+    if diffusion is None:
+        diffusion = {
+            'glucose': 0.1,
+            'acetate': 0.1}
+    return {
+        '_type': 'process',
+        'address': 'local:field-transport',
+        'config': {
+            'n_bins': tuple(n_bins),
+            'bounds': bounds,
+            'diffusion': diffusion,
+            'advection': advection or {},
+        },
+        'inputs': {
+            'fields': path
+        },
+        'outputs': {
+            'fields': path
+        }
+    }
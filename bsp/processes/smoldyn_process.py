@@ -50,6 +50,7 @@
 import math
 import os
 from dataclasses import dataclass
+from functools import partial
 from typing import *
 from uuid import uuid4
 
@@ -58,6 +59,8 @@ from process_bigraph import Process, Composite, pf, pp
 
 from bsp.data_model.base import BaseClass
 from bsp.data_model.sed import SedModel
+from bsp.utils.diffusion_utils import DiffusionModel
+from bsp.utils.smoldyn_utils import ParticleArrays, ParticleIndex, out_of_bounds, reflect_into_bounds
 
 try:
     import smoldyn as sm
@@ -76,6 +79,26 @@ class SmoldynProcess(Process):
         'animate': {
             '_type': 'boolean',
             '_default': False
+        },
+        'particle_output': {
+            '_type': 'string',
+            '_default': 'dict'
+        },
+        'move_tolerance': {
+            '_type': 'float',
+            '_default': 0.0
+        },
+        'coupling': {
+            '_type': 'string',
+            '_default': 'reset'
+        },
+        'vectorized_difc': {
+            '_type': 'boolean',
+            '_default': False
+        },
+        'solution_distance': {
+            '_type': 'float',
+            '_default': 0.0
         }
     }
 
@@ -86,6 +109,19 @@ class SmoldynProcess(Process):
             config_schema = {
                 'model_filepath': 'string',  <-- analogous to python `str`
                 'animate': 'bool'  <-- of type `bigraph_schema.base_types.bool`
+                'particle_output': 'string'  <-- 'dict' for a dict per molecule keyed by its Smoldyn serial number,
+                    'columnar' for arrays of the coordinates (N x 3), species indices, states and serial numbers of
+                    the molecules (`ParticleArraysType`), or 'delta' for only the molecules added, removed or moved
+                    by more than 'move_tolerance' since the previous update (`ParticleDeltaType`)
+                'move_tolerance': 'float'
+                'coupling': 'string'  <-- 'reset' to redistribute every species uniformly within the membrane bounds and
+                    register its diffusion coefficient callback at every update, or 'incremental' to only add or
+                    remove the difference between the input and the simulated counts, reflect the molecules left
+                    outside of the new bounds back into them, and register each callback once
+                'vectorized_difc': 'bool'  <-- compute the force-dependent diffusion coefficients of all species at
+                    once with a `DiffusionModel` and set them through `setSpeciesMobility` for the solution (at
+                    'solution_distance' from the membrane) and surface-bound states, instead of through callbacks
+                'solution_distance': 'float'
 
             # TODO: It would be nice to have classes associated with this.
         """
@@ -155,6 +191,26 @@ class SmoldynProcess(Process):
             'forces': 'list',
         }
 
+        self.particle_output = self.config.get('particle_output', 'dict')
+        self.particles_type = {
+            'columnar': 'ParticleArraysType',
+            'delta': 'ParticleDeltaType'
+        }.get(self.particle_output, 'ParticleType')
+
+        # particles indexed by serial number, kept between updates to follow them
+        self.particle_index = ParticleIndex(tolerance=self.config.get('move_tolerance', 0.0))
+
+        # vectorized force-dependent diffusion coefficients (placeholder d0, alpha and beta as in `_connect_difc`)
+        self.diffusion_model = DiffusionModel(base_difc=[0.3] * len(self.species_names), alpha=0.3, beta=1.0) \
+            if self.config.get('vectorized_difc') else None
+        self.solution_distance = self.config.get('solution_distance', 0.0)
+
+        # incremental coupling: diffusion coefficient arguments per species, updated in place by each update
+        self.coupling = self.config.get('coupling', 'reset')
+        self._difc_args: Dict[str, List] = {}
+        self._difc_interval = None
+        self._difc_values: Dict[str, Tuple] = {}
+
         self._specs = [None for _ in self.species_names]
         self._vals = dict(zip(self.species_names, [[] for _ in self.species_names]))
 
@@ -201,7 +257,7 @@ class SmoldynProcess(Process):
         }
         return {
             'species_counts': species_counts_schema,
-            'particles': 'ParticleType',
+            'particles': self.particles_type,
             'geometry': 'GeometryType',
             'net_forces': 'MechanicalForcesType',
             'notable_vertices': 'list[boolean]'
@@ -214,7 +270,7 @@ class SmoldynProcess(Process):
         }
         return {
             'species_counts': species_counts_schema,
-            'particles': 'ParticleType',
+            'particles': self.particles_type,
             # 'geometry': 'GeometryType',
             # 'net_forces': 'MechanicalForcesType'
         }
@@ -229,33 +285,18 @@ class SmoldynProcess(Process):
         # get upper and lower boundary coords from vertices: iterate over each axis and get max of each axis
         bounds_low, bounds_high = get_kth_boundaries(vertices_k)
 
-        # reset the molecules, distribute the mols according to dynamic bounds
-        for name in self.species_names:
-            set_uniform(
-                simulation=self.simulation,
-                species_name=name,
-                boundary_high=max(bounds_high),
-                boundary_low=min(bounds_low),
-                count=state['species_counts'][name],
-                kill_mol=False
-            )
-
-            # TODO: extract the difc from the model somehow!
-            # d0 = self.simulation.getSpecies(name).difc
-            d0 = 0.3  # placeholder difc
-            forces_k = np.array(state['net_forces'])
-            alpha = 0.3  # TODO: make this not arbitrary
-            beta = 1.0
+        if self.coupling == 'incremental':
+            self._place_incremental(state['species_counts'], bounds_low, bounds_high)
+        else:
+            self._place_reset(state, bounds_low, bounds_high)
 
-            # TODO: we need to take in noticeable vertices from the membrane force prescription and infer beta for given particle based on its coords at iteration k
-            # derive beta based on the given particle's distance at iteration k from the membrane (bounds)
-
-            self.simulation.connect(
-                func=compute_kth_difc,
-                target=f'{name}.difc',
-                step=interval,
-                args=[d0, forces_k, alpha, beta],
-            )
+        # set the force-dependent diffusion coefficients
+        if self.diffusion_model is not None:
+            self._apply_difc(state)
+        elif self.coupling == 'incremental':
+            self._update_difc_args(state, interval)
+        else:
+            self._connect_difc(state, interval)
 
         # run the simulation for a given interval
         self.simulation.run(
@@ -286,26 +327,147 @@ class SmoldynProcess(Process):
             input_counts = state['species_counts'][name]
             simulation_state['species_counts'][name] = int(final_count[index]) - input_counts
 
-        # clear the list of known molecule ids and update the list of known molecule ids (convert to an intstring)
-        self.molecule_ids.clear()
-        for molecule in molecules_data:
-            self.molecule_ids.append(str(uuid4()))
+        # views over the listmols2 rows of the last frame, without a per-molecule object
+        particles = ParticleArrays(molecules_data, self.species_names).last_frame()
+        delta = self.particle_index.update(particles)
 
-        # get and populate the output molecules
-        for index, mol_id in enumerate(self.molecule_ids):
-            single_molecule_data = molecules_data[index]
-            single_molecule_species_index = int(single_molecule_data[1]) - 1
-
-            simulation_state['particles'][mol_id] = {
-                'coordinates': single_molecule_data[3:6],
-                'species_id': self.species_names[single_molecule_species_index],
-                'state': str(int(single_molecule_data[2]))
-            }
+        if self.particle_output == 'columnar':
+            simulation_state['particles'] = particles.to_dict()
+        elif self.particle_output == 'delta':
+            simulation_state['particles'] = delta
+        else:
+            # molecules keyed by serial number, stable between updates
+            particles_view = particles.as_dict_view()
+            self.molecule_ids = list(particles_view.keys())
+            simulation_state['particles'] = dict(particles_view)
 
         # TODO -- post processing to get effective rates
 
         return simulation_state
 
+    def _place_reset(self, state: Dict, bounds_low: List[float], bounds_high: List[float]) -> None:
+        # reset the molecules, distribute the mols according to dynamic bounds
+        for name in self.species_names:
+            set_uniform(
+                simulation=self.simulation,
+                species_name=name,
+                boundary_high=max(bounds_high),
+                boundary_low=min(bounds_low),
+                count=state['species_counts'][name],
+                kill_mol=False
+            )
+
+    def _connect_difc(self, state: Dict, interval: int) -> None:
+        for name in self.species_names:
+            # TODO: extract the difc from the model somehow!
+            # d0 = self.simulation.getSpecies(name).difc
+            d0 = 0.3  # placeholder difc
+            forces_k = np.array(state['net_forces'])
+            alpha = 0.3  # TODO: make this not arbitrary
+            beta = 1.0
+            distance = 0.0  # TODO: derive from the particle coordinates
+
+            # TODO: we need to take in noticeable vertices from the membrane force prescription and infer beta for given particle based on its coords at iteration k
+            # derive beta based on the given particle's distance at iteration k from the membrane (bounds)
+
+            self.simulation.connect(
+                func=compute_kth_difc,
+                target=f'{name}.difc',
+                step=interval,
+                args=[d0, forces_k, distance, alpha, beta],
+            )
+
+    def _apply_difc(self, state: Dict) -> None:
+        """Evaluate the coefficients of all species at once and set them for the coming interval, over which the
+            forces are constant, rather than through a callback per species.
+        """
+        self.diffusion_model.set_forces(state['net_forces'])
+        self.diffusion_model.apply(
+            self.simulation,
+            self.species_names,
+            {
+                MolecState.soln: self.diffusion_model.coefficients(distance=self.solution_distance),
+                MolecState.front: self.diffusion_model.coefficients(distance=0.0),
+                MolecState.back: self.diffusion_model.coefficients(distance=0.0),
+            })
+
+    def _place_incremental(self, species_counts: Dict[str, int], bounds_low: List[float], bounds_high: List[float]) -> None:
+        """Keep the molecules in place, reflecting those left outside of the new bounds back into them, and only add
+            or remove the difference between the input and the simulated count of each species.
+
+            NOTE: Smoldyn does not expose a way to move a given molecule, so a species with molecules outside of the new
+                bounds has its solution molecules killed and re-added one by one at their reflected coordinates. Only
+                the species which actually have molecules outside of the bounds pay for this. The re-added molecules
+                get new serial numbers, so the old serials of that species are dropped from `particle_index`: the next
+                delta output reports them under 'dropped', and their replacements as added.
+        """
+        dim = len(self.boundaries['low'])
+        low = np.asarray(bounds_low[:dim], dtype=float)
+        high = np.asarray(bounds_high[:dim], dtype=float)
+
+        # reflect the solution molecules of the last frame lying outside of the new bounds
+        index = self.particle_index
+        if len(index):
+            coordinates = index.coordinates[:, :dim]
+            solution = index.state == int(MolecState.soln)
+            outside = out_of_bounds(coordinates, low, high) & solution
+            readded = np.zeros(len(index), dtype=bool)
+            for species_index in np.unique(index.species_index[outside]).tolist():
+                name = self.species_names[species_index]
+                rows = (index.species_index == species_index) & solution
+                positions = reflect_into_bounds(coordinates[rows], low, high)
+                self.simulation.runCommand(f'killmol {name}(solution)')
+                for position in positions.tolist():
+                    self.simulation.addSolutionMolecules(species=name, number=1, lowpos=position, highpos=position)
+                readded |= rows
+            index.forget(readded)
+
+        # add or remove only the count difference
+        for name in self.species_names:
+            target_count = int(species_counts[name])
+            difference = target_count - self.simulation.getMoleculeCount(name, MolecState.all)
+            if difference > 0:
+                self.simulation.addSolutionMolecules(
+                    species=name,
+                    number=difference,
+                    lowpos=low.tolist(),
+                    highpos=high.tolist()
+                )
+            elif difference < 0:
+                # removes randomly chosen molecules of the species
+                self.simulation.runCommand(f'fixmolcount {name} {target_count}')
+
+    def _update_difc_args(self, state: Dict, interval: int) -> None:
+        """Update the arguments of the diffusion coefficient callbacks in place, registering each callback only once.
+            The callbacks run at every simulation step and recompute the coefficient once per current `interval`.
+        """
+        forces_k = np.asarray(state['net_forces'], dtype=float)
+        self._difc_interval = interval
+        self._difc_values = {}
+        for name in self.species_names:
+            # TODO: extract the difc from the model and derive the distance from the particle coordinates
+            d0, distance, alpha, beta = 0.3, 0.0, 0.3, 1.0
+            args = [d0, forces_k, distance, alpha, beta]
+            if name in self._difc_args:
+                self._difc_args[name][:] = args
+                continue
+
+            self._difc_args[name] = args
+            self.simulation.connect(
+                func=partial(self._compute_difc, name),
+                target=f'{name}.difc',
+                step=1,
+                args=[],
+            )
+
+    def _compute_difc(self, species_name: str, t, args):
+        # smoldyn passes the step and args given at registration: read the interval and args set by the latest
+        # `_update_difc_args` instead
+        last = self._difc_values.get(species_name)
+        if last is None or t - last[0] >= self._difc_interval:
+            last = self._difc_values[species_name] = (t, compute_kth_difc(t, self._difc_args[species_name]))
+        return last[1]
+
 
 # TODO: finish this
 @dataclass
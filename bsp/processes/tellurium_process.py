@@ -3,11 +3,22 @@ Tellurium Process
 """
 
 
+import copy
+from typing import List
+from uuid import uuid4
+
 import numpy as np
 import tellurium as te
 from process_bigraph import Process, Composite, pf, Step
 
 from bsp.data_model.sed import SedModel as SEDModelType
+from bsp.utils.tellurium_utils import (
+    ROADRUNNER_CACHE,
+    RoadRunnerCache,
+    CheckpointStore,
+    FileCheckpointStore,
+    MemoryCheckpointStore
+)
 
 # from biosimulators_processes import CORE
 # from biosimulators_processes.processes.utc_process import SbmlUniformTimeCourse
@@ -88,9 +99,9 @@ class TelluriumStep(Step):
 
         # initialize a tellurium(roadrunner) simulation object. Load the model in using either sbml(default) or antimony
         if self.config.get('antimony_string') and not self.config.get('sbml_model_path'):
-            self.simulator = te.loada(self.config['antimony_string'])
+            self.simulator = ROADRUNNER_CACHE.get(antimony_string=self.config['antimony_string'])
         elif self.config.get('sbml_model_path') and not self.config.get('antimony_string'):
-            self.simulator: te.roadrunner.extended_roadrunner.ExtendedRoadRunner = te.loadSBMLModel(self.config['sbml_model_path'])
+            self.simulator: te.roadrunner.extended_roadrunner.ExtendedRoadRunner = ROADRUNNER_CACHE.get(sbml_model_path=self.config['sbml_model_path'])
         else:
             raise Exception('the config requires either an "antimony_string" or an "sbml_model_path"')
 
@@ -161,20 +172,23 @@ class TelluriumProcess(Process):
             '_default': 'concentrations',
             '_type': 'string'
         },
-        'num_steps': 'maybe[integer]'
+        'num_steps': 'maybe[integer]',
+        'checkpoint_dir': 'maybe[string]'  # keep checkpoints on disk rather than in memory if passed
     }
 
     simulator: te.roadrunner.extended_roadrunner.ExtendedRoadRunner
+    checkpoints: CheckpointStore
 
     def __init__(self, config=None, core=None):
         super().__init__(config, core)
 
         model_source = self.config['model']['model_source']
+        # compiled models are cloned from the process-wide cache rather than recompiled
         if '/' in model_source:
-            self.simulator = te.loadSBMLModel(model_source)
+            self.simulator = ROADRUNNER_CACHE.get(sbml_model_path=model_source)
         else:
             if 'model' in model_source:  # TODO: find a better way to do this
-                self.simulator = te.loada(model_source)
+                self.simulator = ROADRUNNER_CACHE.get(antimony_string=model_source)
             else:
                 raise Exception('the config requires either an "antimony_string" or an "sbml_model_path"')
 
@@ -207,6 +221,46 @@ class TelluriumProcess(Process):
         # Get a list of reactions
         self.reaction_list = self.simulator.getReactionIds()
 
+        # binary state checkpoints
+        checkpoint_dir = self.config.get('checkpoint_dir')
+        self.checkpoints = FileCheckpointStore(checkpoint_dir) if checkpoint_dir else MemoryCheckpointStore()
+
+    def checkpoint(self, label: str = None) -> str:
+        """Save the current RoadRunner state (time, species, parameters and integrator settings) under `label`.
+
+            Returns:
+                `str`: label of the checkpoint. Defaults to a `checkpoint_<n>` label not already in use.
+        """
+        if not label:
+            labels = set(self.checkpoints.labels())
+            n = len(labels)
+            while f'checkpoint_{n}' in labels:
+                n += 1
+            label = f'checkpoint_{n}'
+        self.checkpoints.save(label, self.simulator.saveStateS())
+        return label
+
+    def restore(self, label: str) -> None:
+        """Rewind this process to the RoadRunner state saved under `label`."""
+        self.simulator.loadStateS(self.checkpoints.load(label))
+
+    def branch(self, label: str, n_branches: int = 1) -> List['TelluriumProcess']:
+        """Create `n_branches` independent continuations of this process from the checkpoint `label`. Each branch
+            costs one state load into a new RoadRunner instance rather than a rebuild and replay of the model.
+            Each branch has its own checkpoint store, holding only the checkpoint `label`, so that the checkpoints of
+            a branch do not overwrite those of this process or of the other branches.
+        """
+        state = self.checkpoints.load(label)
+        branches = []
+        for _ in range(n_branches):
+            branch = copy.copy(self)
+            branch.simulator = RoadRunnerCache.clone(state)
+            branch.checkpoints = self.checkpoints.fork(f'{label}_{uuid4().hex}')
+            branch.checkpoints.save(label, state)
+            branches.append(branch)
+
+        return branches
+
     def initial_state(self, config=None):
         floating_species_dict = dict(zip(self.floating_species_list, self.floating_species_initial))
         boundary_species_dict = dict(zip(self.boundary_species_list, self.boundary_species_initial))
@@ -1,14 +1,24 @@
 import dataclasses
+import hashlib
+import importlib
+import importlib.metadata
+import json
+import logging
 import os
+import sys
+import warnings
 from types import ModuleType
 from typing import *
 
 from process_bigraph import ProcessTypes
 
-from bsp.utils.base_utils import dynamic_simulator_install
+from bsp.utils.base_utils import dynamic_simulator_install, file_lock
 from bsp.data_model.base import Implementation, Type
 
 
+logger = logging.getLogger(__name__)
+
+
 @dataclasses.dataclass
 class ImplementationRegistry:
     id: str
@@ -20,14 +30,196 @@ class SimulatorDependency(str):
     pass
 
 
+class RegistryManifest(object):
+    """Persisted record of which implementation addresses can be imported in the current environment.
+
+        Entries are grouped under a key hashing the interpreter and the installed versions of bsp, process-bigraph
+        and every implementation dependency, so that a change to any of these starts a new record. The versions are
+        read from the package metadata, which does not import the packages. An implementation whose dependencies are
+        not installed is recorded as unavailable without an import attempt, and every successful import is recorded
+        too. Import failures are not persisted, as they may be transient (e.g. within an editable install), so that
+        such implementations are attempted again by later processes.
+
+        The manifest is opt-in: `bsp` only uses one when `$BSP_REGISTRY_MANIFEST` is set to its filepath, and only
+        writes it once, when the registry is first built. Imports deferred past that point are recorded in memory.
+
+        Dependencies from channels other than PyPI (e.g. 'conda-forge::pymem3dg') cannot be found from the package
+        metadata, so they are not checked: their implementations are always attempted.
+
+        Reading and writing the manifest are best-effort: an unreadable manifest is logged, an unwritable one raises a
+        warning, and the entries are kept in memory only. Entries recorded while registering are written at once by
+        `flush`.
+
+        Args:
+            path:`Optional[str]`: manifest filepath. Defaults to `$BSP_REGISTRY_MANIFEST`, or
+                `~/.bsp/registry_manifest.json`.
+    """
+    base_packages = ['biosimulator-processes', 'process-bigraph']
+    version = 2
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv('BSP_REGISTRY_MANIFEST') \
+            or os.path.join(os.path.expanduser('~'), '.bsp', 'registry_manifest.json')
+        self.package_versions: Dict[str, Optional[str]] = {}
+        self.key: Optional[str] = None
+        self.entries: Dict[str, Dict] = {}
+        self._changed: Set[str] = set()
+
+    @staticmethod
+    def package_version(package: str) -> Optional[str]:
+        try:
+            return importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            return None
+
+    @staticmethod
+    def distribution_name(dependency: str) -> Optional[str]:
+        """PyPI distribution name of a dependency spec, or None for a spec from another channel."""
+        return None if '::' in dependency else dependency
+
+    def bind(self, implementations: List[Implementation]) -> None:
+        """Probe the versions of the dependencies of `implementations` and load the entries recorded for the
+            resulting environment.
+        """
+        dependencies = [self.distribution_name(dep) for impl in implementations for dep in impl.dependencies]
+        packages = sorted({*self.base_packages, *[dep for dep in dependencies if dep is not None]})
+        self.package_versions = {package: self.package_version(package) for package in packages}
+        environment = {
+            'manifest_version': self.version,
+            'python': sys.version,
+            'executable': sys.executable,
+            'packages': self.package_versions
+        }
+        self.key = hashlib.sha256(json.dumps(environment, sort_keys=True).encode()).hexdigest()
+        self.entries = self.read().get(self.key, {}).get('addresses', {})
+        self._changed = set()
+
+    def read(self) -> Dict:
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f'Cannot read the registry manifest {self.path}: {e}')
+            return {}
+
+    def get(self, address: str) -> Optional[Dict]:
+        return self.entries.get(address)
+
+    def missing_dependencies(self, implementation: Implementation) -> List[str]:
+        return [
+            dep for dep in implementation.dependencies
+            if self.distribution_name(dep) is not None and self.package_versions.get(dep) is None]
+
+    def record(self, address: str, available: bool, error: Optional[str] = None) -> None:
+        """Record the entry of `address` in memory, to be written by the next `flush`."""
+        entry = {'available': available, 'error': error}
+        if self.entries.get(address) != entry:
+            self.entries[address] = entry
+            self._changed.add(address)
+
+    def forget(self, address: str) -> None:
+        if self.entries.pop(address, None) is not None:
+            self._changed.add(address)
+
+    def flush(self) -> None:
+        """Merge the entries changed since the last flush into the manifest file, if any. Failures are not fatal: they
+            raise a warning and the entries are kept in memory.
+        """
+        if not self._changed or self.key is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with file_lock(f'{self.path}.lock'):
+                manifest = self.read()
+                environment = manifest.setdefault(
+                    self.key, {'python': sys.version, 'packages': self.package_versions, 'addresses': {}})
+                for address in self._changed:
+                    if address in self.entries:
+                        environment['addresses'][address] = self.entries[address]
+                    else:
+                        environment['addresses'].pop(address, None)
+                tmp_path = f'{self.path}.{os.getpid()}.tmp'
+                with open(tmp_path, 'w') as f:
+                    json.dump(manifest, f, indent=2, sort_keys=True)
+                os.replace(tmp_path, self.path)
+        except Exception as e:
+            warnings.warn(f'Cannot write the registry manifest {self.path}: {e}')
+        self._changed = set()
+
+
+class LazyProcessRegistry(object):
+    """Process registry which records implementations by address and dotted location, and imports each class only the
+        first time its address is accessed.
+
+        Wraps the process registry of a `ProcessTypes` core: every attribute other than `access` and `list` is
+        delegated to the wrapped registry, into which the class is registered once imported. An implementation which
+        fails to import is dropped, and its error kept in `import_errors`.
+
+        Args:
+            registry:`Registry`: the process registry to wrap.
+            verbose:`bool`: whether to print the outcome of each deferred import.
+            attempt_install:`bool`: whether to attempt installing the simulator of an implementation which fails to
+                import.
+            on_load:`Optional[Callable]`: called with the address and the import error (None on success) of every
+                deferred import.
+    """
+    def __init__(self, registry, verbose=False, attempt_install=False, on_load: Optional[Callable] = None):
+        self._registry = registry
+        self.on_load = on_load
+        self.pending: Dict[str, Implementation] = {}
+        self.import_errors: Dict[str, str] = {}
+        self.verbose = verbose
+        self.attempt_install = attempt_install
+
+    def __getattr__(self, name):
+        if name == '_registry':
+            raise AttributeError(name)
+        return getattr(self._registry, name)
+
+    def register_lazy(self, implementation: Implementation) -> None:
+        self.pending[implementation.address] = implementation
+
+    def load(self, address: str) -> None:
+        implementation = self.pending.pop(address)
+        library, module_name, class_name = implementation.location.rsplit('.', 3)
+        try:
+            module = importlib.import_module(f'bsp.{library}.{module_name}')
+            bigraph_class = getattr(module, class_name)
+            self._registry.register(address, bigraph_class)
+            if self.on_load is not None:
+                self.on_load(address, None)
+            if self.verbose:
+                print(f"Successfully registered {bigraph_class} to {address}")
+        except Exception as e:
+            self.import_errors[address] = str(e)
+            if self.on_load is not None:
+                self.on_load(address, str(e))
+            if self.verbose:
+                print(f"Cannot register {class_name}. Error:\n**\n{e}\n**")
+            if self.attempt_install:
+                dynamic_simulator_install(simulators=[library])
+
+    def access(self, key):
+        if key in self.pending:
+            self.load(key)
+        return self._registry.access(key)
+
+    def list(self) -> List[str]:
+        return list(self._registry.list()) + [address for address in self.pending if address not in self._registry.registry]
+
+
 class Registrar(object):
     registries: List[ImplementationRegistry]
     core: ProcessTypes
     registered_addresses: List[str]
     implementation_dependencies: Dict[str, List[SimulatorDependency]]
 
-    def __init__(self, core: ProcessTypes = None):
+    def __init__(self, core: ProcessTypes = None, lazy: bool = False, manifest: Optional[RegistryManifest] = None):
         self.core = core or ProcessTypes()
+        self.lazy = lazy
+        self.manifest = manifest
         self.registries = []
 
         default_reg = ImplementationRegistry(
@@ -43,7 +235,46 @@ class Registrar(object):
 
     @property
     def registered_addresses(self) -> List[str]:
-        return list(self.core.process_registry.registry.keys())
+        return list(self.core.process_registry.list())
+
+    def _lazy_process_registry(self, verbose=False, attempt_install=False) -> LazyProcessRegistry:
+        registry = self.core.process_registry
+        if not isinstance(registry, LazyProcessRegistry):
+            registry = LazyProcessRegistry(
+                registry, verbose=verbose, attempt_install=attempt_install, on_load=self._record_import)
+            self.core.process_registry = registry
+        return registry
+
+    def available_addresses(self) -> List[str]:
+        """Registered addresses, less those known not to be importable: implementations recorded as unavailable in
+            the manifest are never registered, and those whose deferred import has failed are excluded.
+        """
+        registry = self.core.process_registry
+        import_errors = registry.import_errors if isinstance(registry, LazyProcessRegistry) else {}
+        return [address for address in self.registered_addresses if address not in import_errors]
+
+    def _record_import(self, address: str, error: Optional[str] = None) -> None:
+        """Record a successful import in the manifest, and forget a failed one, which may be transient. The entry is
+            kept in memory: the manifest file is only written when the registry is first built.
+        """
+        if self.manifest is None or self.manifest.key is None:
+            return
+        if error is None:
+            self.manifest.record(address, available=True)
+        else:
+            self.manifest.forget(address)
+
+    def _known_unavailable(self, implementation: Implementation) -> bool:
+        if self.manifest is None or self.manifest.key is None:
+            return False
+        entry = self.manifest.get(implementation.address)
+        if entry is None:
+            missing = self.manifest.missing_dependencies(implementation)
+            if not missing:
+                return False
+            self.manifest.record(implementation.address, available=False, error=f'Missing dependencies: {missing}')
+            entry = self.manifest.get(implementation.address)
+        return not entry['available']
 
     def add_registry(self, registry: ImplementationRegistry):
         if registry.primary:
@@ -76,6 +307,16 @@ class Registrar(object):
             print(f"Successfully registered {implementation} to address: {address}")
 
     def register_module(self, implementation: Implementation, verbose=False, attempt_install=False) -> None:
+        if self._known_unavailable(implementation) and not attempt_install:
+            if verbose:
+                print(f"Skipping {implementation.address}: {self.manifest.get(implementation.address)['error']}")
+            return
+
+        if self.lazy:
+            # record the address only: the class is imported the first time the address is accessed
+            self._lazy_process_registry(verbose, attempt_install).register_lazy(implementation)
+            return
+
         library, module_name, class_name = implementation.location.rsplit('.', 3)
         try:
             # library = 'steps' if 'process' not in path else 'processes'
@@ -84,9 +325,11 @@ class Registrar(object):
                  import_statement, fromlist=[class_name])
             bigraph_class = getattr(module, class_name)
             self.core.process_registry.register(implementation.address, bigraph_class)
+            self._record_import(implementation.address)
             if verbose:
                 print(f"Successfully registered {bigraph_class} to {implementation.address}")
         except Exception as e:
+            self._record_import(implementation.address, str(e))
             if verbose:
                 print(f"Cannot register {class_name}. Error:\n**\n{e}\n**")
             if attempt_install:
@@ -100,10 +343,15 @@ class Registrar(object):
             attempt_install=False
     ) -> None:
         if not self.initial_registration_complete:
+            if self.manifest is not None:
+                self.manifest.bind(items_to_register)
             for implementation in items_to_register:
                 self.register_module(implementation=implementation, verbose=verbose, attempt_install=attempt_install)
                 process_deps = [SimulatorDependency(dep) for dep in implementation.dependencies]
                 self.implementation_dependencies[implementation.address] = process_deps
+            if self.manifest is not None:
+                # write the entries recorded while registering at once
+                self.manifest.flush()
             self.initial_registration_complete = True
 
     def register_type_module(self, module: ModuleType, verbose=False) -> None:
@@ -16,7 +16,9 @@ __all__ = [
     'VelocitiesType',
     'OsmoticParametersType',
     'SurfaceTensionParametersType',
-    'ParticleType'
+    'ParticleType',
+    'ParticleArraysType',
+    'ParticleDeltaType'
 ]
 
 
@@ -26,6 +28,10 @@ def apply_non_negative(schema, current, update, core):
     return max(0, new_value)
 
 
+def apply_replace(schema, current, update, core):
+    return update
+
+
 # -- types: that is, schemas related to input and output port data, not configs
 
 PositiveFloatType = {
@@ -73,3 +79,17 @@ ParticleType = {
     'state': 'integer'
 }
 
+# columnar particle data ({'coordinates': (N, 3), 'species_index': (N,), 'state': (N,), 'serial': (N,)} arrays),
+# replaced as a whole at each update
+ParticleArraysType = {
+    '_type': 'particle_arrays',
+    '_inherit': 'any',
+    '_apply': apply_replace
+}
+
+# particles added, moved (columnar, as ParticleArraysType), removed and dropped from tracking (serials) since the previous update
+ParticleDeltaType = {
+    '_type': 'particle_delta',
+    '_inherit': 'any',
+    '_apply': apply_replace
+}
@@ -1,5 +1,4 @@
 import os
-import re
 import uuid
 from abc import abstractmethod
 from logging import warn
@@ -15,6 +14,7 @@ from simulariumio.smoldyn import SmoldynData
 
 from bsp.data_generators import SBML_EXECUTORS
 from bsp.io import get_sbml_species_mapping
+from bsp.utils.smoldyn_utils import SmoldynOutputReader
 from bsp.utils.simularium_utils import translate_data_object, write_simularium_file, calculate_agent_radius
 
 VERBOSE = False
@@ -491,17 +491,9 @@ def generate_simularium_file(
         run_validation: bool = True,
         agent_parameters: Dict[str, Dict[str, Any]] = None
 ) -> Dict[str, str]:
-    species_names = []
-    float_pattern = re.compile(r'^-?\d+(\.\d+)?$')
-    with open(input_fp, 'r') as f:
-        output = [l.strip() for l in f.readlines()]
-        for line in output:
-            datum = line.split(' ')[0]
-            # Check if the datum is not a float string
-            if not float_pattern.match(datum):
-                species_names.append(datum)
-        f.close()
-    species_names = list(set(species_names))
+    # streamed in chunks, and cached in the sidecar index of the output file for later calls. The names keep their
+    # state suffix (e.g. 'a(front)') as written in the output file.
+    species_names = SmoldynOutputReader(input_fp).molecule_labels()
 
     simularium = SimulariumSmoldynStep(config={
         'output_dest': dest_dir,
@@ -0,0 +1,188 @@
+import hashlib
+import json
+import logging
+import os
+import re
+from typing import Optional, Dict, List
+
+import numpy as np
+import amici
+from amici import SbmlImporter, import_model_module
+
+from bsp.utils.base_utils import file_lock
+
+
+class AmiciModelStore(object):
+    """Persistent store of compiled AMICI model modules keyed by SBML content and import settings.
+
+        `SbmlImporter.sbml2amici` generates and C++-compiles a Python extension for every model, which takes minutes.
+        Each compiled module is kept in `<root>/<key>/`, where `key` hashes the SBML content, the observables,
+        constant parameters and sigmas passed to the importer and the installed AMICI version. Compilation is
+        serialized across processes by a lock file per key, and a `.complete` marker is written only once the
+        module has been fully built, so that a worker never imports a half-written extension. Module names carry a
+        prefix of the key, as an extension of a given name can only be imported once per interpreter.
+
+        Args:
+            root:`Optional[str]`: store directory. Defaults to `$BSP_AMICI_MODEL_DIR`, or `~/.bsp/amici_models`.
+    """
+    complete_marker = '.complete'
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or os.getenv('BSP_AMICI_MODEL_DIR') or os.path.join(os.path.expanduser('~'), '.bsp', 'amici_models')
+        self._modules = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def model_key(
+            sbml_fp: str,
+            observables: Optional[Dict] = None,
+            constant_parameters: Optional[List[str]] = None,
+            sigmas: Optional[Dict] = None
+    ) -> str:
+        digest = hashlib.sha256()
+        with open(sbml_fp, 'rb') as f:
+            digest.update(f.read())
+        import_settings = {
+            'observables': observables,
+            'constant_parameters': constant_parameters,
+            'sigmas': sigmas,
+            'amici_version': amici.__version__
+        }
+        digest.update(json.dumps(import_settings, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def module_name(model_id: str, key: str) -> str:
+        name = re.sub(r'\W', '_', model_id)
+        if not name or name[0].isdigit():
+            name = f'model_{name}'
+        return f'{name}_{key[:12]}'
+
+    def model_dir(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def is_compiled(self, key: str) -> bool:
+        return os.path.exists(os.path.join(self.model_dir(key), self.complete_marker))
+
+    def get_model_module(
+            self,
+            sbml_fp: str,
+            model_id: str,
+            observables: Optional[Dict] = None,
+            constant_parameters: Optional[List[str]] = None,
+            sigmas: Optional[Dict] = None
+    ):
+        """Return the compiled AMICI model module for the given SBML file and import settings, compiling it into
+            the store only if no process has done so before.
+
+            Args:
+                sbml_fp:`str`: path to the SBML model file.
+                model_id:`str`: model name, used as the prefix of the module name.
+                observables:`Optional[Dict]`: observables passed to `sbml2amici`.
+                constant_parameters:`Optional[List[str]]`: constant parameters passed to `sbml2amici`.
+                sigmas:`Optional[Dict]`: sigmas passed to `sbml2amici`.
+        """
+        key = self.model_key(sbml_fp, observables, constant_parameters, sigmas)
+        module_name = self.module_name(model_id, key)
+        module = self._modules.get(module_name)
+        if module is not None:
+            self.hits += 1
+            return module
+
+        output_dir = self.model_dir(key)
+        if self.is_compiled(key):
+            self.hits += 1
+        else:
+            os.makedirs(self.root, exist_ok=True)
+            with file_lock(os.path.join(self.root, f'{key}.lock')):
+                # another worker may have compiled the model while this one was waiting for the lock
+                if not self.is_compiled(key):
+                    self.misses += 1
+                    SbmlImporter(sbml_fp).sbml2amici(
+                        model_name=module_name,
+                        output_dir=output_dir,
+                        verbose=logging.INFO,
+                        observables=observables,
+                        constant_parameters=constant_parameters,
+                        sigmas=sigmas)
+                    with open(os.path.join(output_dir, self.complete_marker), 'w') as f:
+                        f.write(module_name)
+                else:
+                    self.hits += 1
+
+        module = import_model_module(module_name, output_dir)
+        self._modules[module_name] = module
+        return module
+
+
+AMICI_MODEL_STORE = AmiciModelStore()
+
+
+# -- batched simulation --
+
+def build_exp_data(
+        model,
+        initial_states: Optional[np.ndarray] = None,
+        parameters: Optional[np.ndarray] = None
+) -> List['amici.ExpData']:
+    """Create one `ExpData` per row of `initial_states`/`parameters`, each carrying the model timepoints.
+
+        Args:
+            model:`amici.Model`: model from which the timepoints and the default values are taken.
+            initial_states:`Optional[np.ndarray]`: array of shape (batch, states).
+            parameters:`Optional[np.ndarray]`: array of shape (batch, parameters), ordered as `model.getParameterIds()`.
+    """
+    if initial_states is None and parameters is None:
+        raise ValueError('You must pass either "initial_states" or "parameters" to build a batch.')
+    initial_states = np.atleast_2d(initial_states).astype(float) if initial_states is not None else None
+    parameters = np.atleast_2d(parameters).astype(float) if parameters is not None else None
+    batch_size = max(len(a) for a in (initial_states, parameters) if a is not None)
+
+    # a single row of either array is broadcast over the batch
+    edata_list = []
+    for i in range(batch_size):
+        edata = amici.ExpData(model)
+        if initial_states is not None:
+            edata.x0 = initial_states[i % len(initial_states)].tolist()
+        if parameters is not None:
+            edata.parameters = parameters[i % len(parameters)].tolist()
+        edata_list.append(edata)
+    return edata_list
+
+
+def run_batch(model, solver, edata_list: List['amici.ExpData'], num_threads: int = 1) -> np.ndarray:
+    """Simulate every `ExpData` of `edata_list` through `amici.runAmiciSimulations` and stack the state
+        trajectories into an array of shape (batch, time, state). The simulations are distributed over
+        `num_threads` only if AMICI has been compiled with OpenMP, and run sequentially otherwise.
+    """
+    rdata_list = amici.runAmiciSimulations(model, solver, edata_list, num_threads=num_threads)
+    failed = [i for i, rdata in enumerate(rdata_list) if rdata.status != amici.AMICI_SUCCESS]
+    if failed:
+        raise RuntimeError(f'AMICI simulation failed for batch members {failed}.')
+    return np.stack([np.asarray(rdata.x) for rdata in rdata_list])
+
+
+# -- sensitivities --
+
+SENSITIVITY_METHODS = {
+    'forward': amici.SensitivityMethod.forward,
+    'adjoint': amici.SensitivityMethod.adjoint,
+}
+
+
+def configure_sensitivities(model, solver, method: str) -> None:
+    """Enable first-order sensitivities with respect to all model parameters.
+
+        Args:
+            model:`amici.Model`: model for which the sensitivities are required.
+            solver:`amici.Solver`: solver to configure.
+            method:`str`: one of `SENSITIVITY_METHODS`. Forward sensitivities yield both the state sensitivities
+                (`sx`) and the log-likelihood gradient (`sllh`). Adjoint sensitivities yield only `sllh`, at a cost
+                which does not grow with the number of parameters, and require measurements.
+    """
+    if method not in SENSITIVITY_METHODS:
+        raise ValueError(f'"{method}" is not a valid sensitivity method. Choose one of {list(SENSITIVITY_METHODS)}.')
+    model.requireSensitivitiesForAllParameters()
+    solver.setSensitivityOrder(amici.SensitivityOrder.first)
+    solver.setSensitivityMethod(SENSITIVITY_METHODS[method])
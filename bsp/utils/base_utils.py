@@ -2,11 +2,17 @@ import traceback
 import subprocess
 import sys
 import importlib
+from contextlib import contextmanager
 from dataclasses import dataclass
 from pprint import pformat
 from types import ModuleType
 from typing import Optional
 
+try:
+    import fcntl
+except ImportError:  # windows: file locks are not taken
+    fcntl = None
+
 
 def handle_exception(error_key: str | Exception = "bio-compose-error") -> str:
     tb_str = traceback.format_exc()
@@ -61,6 +67,24 @@ def dynamic_simulator_install(simulators: list[str], verbose: bool = True):
             print(f"{sim} installed successfully.") if verbose else None
 
 
+@contextmanager
+def file_lock(lock_path: str):
+    """
+    Hold an exclusive advisory lock on `lock_path` (created if missing) for the duration of the context. Used to
+    serialize writes to on-disk caches which are shared by concurrent worker processes.
+
+    :param lock_path: (`str`) path of the lock file.
+    """
+    with open(lock_path, 'w') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
 def new_document(name, address, _type, config, inputs, outputs, local_implementations=True, add_emitter=True):
     doc = {
         name: {
@@ -0,0 +1,370 @@
+import json
+import os
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple, List
+
+import numpy as np
+import cobra
+from cobra.io import load_model
+
+
+class IncrementalFBA(object):
+    """Repeatedly re-solve an FBA problem whose bounds change only slightly between solves.
+
+        `cobra.Model.optimize` builds a full `Solution`, materializing the fluxes, reduced costs and shadow prices of
+        every reaction and metabolite as pandas Series. This helper keeps the solver problem of `model` in place,
+        writes only the bounds which have actually changed, solves with `slim_optimize` and reads the primal values
+        of only the requested reactions. Presolve is turned off so that the simplex solver restarts from the basis
+        of the previous solution, which after a small bound change is usually a few pivots from the new optimum.
+
+        Args:
+            model:`cobra.Model`: model whose objective is optimized.
+            flux_reactions:`Iterable[str]`: ids of the reactions whose fluxes are returned by `solve`.
+    """
+    def __init__(self, model: cobra.Model, flux_reactions: Iterable[str]):
+        self.model = model
+        self.flux_reactions = {reaction_id: model.reactions.get_by_id(reaction_id) for reaction_id in flux_reactions}
+        self._reactions = {}
+        self.model.solver.configuration.presolve = False
+
+    def _get_reaction(self, reaction_id: str) -> cobra.Reaction:
+        reaction = self._reactions.get(reaction_id)
+        if reaction is None:
+            reaction = self._reactions[reaction_id] = self.model.reactions.get_by_id(reaction_id)
+        return reaction
+
+    def set_lower_bounds(self, lower_bounds: Dict[str, float]) -> int:
+        """Write the lower bounds which differ from the ones currently in the solver and return how many did. The
+            current bounds are read from the model rather than tracked here, as the model may be shared.
+        """
+        n_changed = 0
+        for reaction_id, lower_bound in lower_bounds.items():
+            reaction = self._get_reaction(reaction_id)
+            if reaction.lower_bound != lower_bound:
+                reaction.lower_bound = lower_bound
+                n_changed += 1
+        return n_changed
+
+    def solve(self) -> Optional[Dict[str, float]]:
+        """Solve the problem and return the fluxes of `flux_reactions`, or None if no optimal solution was found."""
+        objective_value = self.model.slim_optimize(error_value=None)
+        if objective_value is None:
+            return None
+        return {reaction_id: reaction.flux for reaction_id, reaction in self.flux_reactions.items()}
+
+
+class FBASolutionCache(object):
+    """LRU cache of FBA fluxes keyed by lower bounds quantized to `tolerance`.
+
+        Each entry keeps the exact bounds it was solved with and the reduced costs of the bounded reactions. On a
+        lookup, the change in the objective flux caused by the difference between the requested and the cached
+        bounds is estimated to first order as `sum(|reduced cost| * |delta bound|)`, and the change in any bounded
+        flux as at most `max(|delta bound|)`. If either estimate exceeds `error_bound`, the lookup is counted as a
+        rejection and treated as a miss, so that the accuracy traded for speed stays controlled.
+
+        Args:
+            tolerance:`float`: quantization step of the bounds.
+            max_size:`int`: maximum number of cached solutions.
+            error_bound:`Optional[float]`: maximum tolerated estimated flux error on a hit. Defaults to `tolerance`.
+    """
+    def __init__(self, tolerance: float, max_size: int = 1024, error_bound: Optional[float] = None):
+        if tolerance <= 0:
+            raise ValueError('The cache tolerance must be positive.')
+        self.tolerance = tolerance
+        self.max_size = max_size
+        self.error_bound = error_bound if error_bound is not None else tolerance
+        self._entries: OrderedDict[Tuple, Tuple[Dict[str, float], Dict[str, float], Dict[str, float]]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.rejections = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def key(self, lower_bounds: Dict[str, float]) -> Tuple:
+        return tuple(
+            (reaction_id, int(round(lower_bound / self.tolerance)))
+            for reaction_id, lower_bound in sorted(lower_bounds.items()))
+
+    def estimate_error(
+            self,
+            lower_bounds: Dict[str, float],
+            cached_bounds: Dict[str, float],
+            reduced_costs: Dict[str, float]
+    ) -> float:
+        deltas = {reaction_id: abs(lower_bound - cached_bounds[reaction_id]) for reaction_id, lower_bound in lower_bounds.items()}
+        objective_error = sum(abs(reduced_costs.get(reaction_id, 0.0)) * delta for reaction_id, delta in deltas.items())
+        return max(objective_error, max(deltas.values(), default=0.0))
+
+    def get(self, lower_bounds: Dict[str, float]) -> Optional[Dict[str, float]]:
+        key = self.key(lower_bounds)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        cached_bounds, reduced_costs, fluxes = entry
+        if self.estimate_error(lower_bounds, cached_bounds, reduced_costs) > self.error_bound:
+            self.rejections += 1
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return fluxes
+
+    def put(self, lower_bounds: Dict[str, float], fluxes: Dict[str, float], reduced_costs: Dict[str, float]) -> None:
+        key = self.key(lower_bounds)
+        self._entries[key] = (dict(lower_bounds), dict(reduced_costs), dict(fluxes))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'rejections': self.rejections, 'size': len(self)}
+
+
+# caches shared by every process solving the same FBA problem, e.g. the bins of a spatial dFBA
+FBA_SOLUTION_CACHES: Dict[str, FBASolutionCache] = {}
+
+
+def get_solution_cache(problem: Dict, tolerance: float, max_size: int = 1024, error_bound: Optional[float] = None) -> FBASolutionCache:
+    """Return the solution cache shared by every process solving the FBA problem described by `problem`, which must
+        hold everything other than the cached bounds that the solution depends on (model, fixed bounds, objective).
+    """
+    key = json.dumps({**problem, 'tolerance': tolerance, 'error_bound': error_bound}, sort_keys=True, default=str)
+    cache = FBA_SOLUTION_CACHES.get(key)
+    if cache is None:
+        cache = FBA_SOLUTION_CACHES[key] = FBASolutionCache(tolerance, max_size=max_size, error_bound=error_bound)
+    return cache
+
+
+def load_cobra_model(model_file: str) -> cobra.Model:
+    """Load a COBRA model from an SBML file path, or by name from the COBRA model repositories ('TESTING' loads the
+        textbook model).
+    """
+    if model_file == 'TESTING':
+        return load_model('textbook')
+    elif 'xml' not in model_file:
+        return load_model(model_file)
+    return cobra.io.read_sbml_model(model_file)
+
+
+class CobraModelProvider(object):
+    """Lazily loads COBRA models on first request and keeps them for the lifetime of the interpreter.
+
+        Loading a model (and initializing its solver) is deferred until a process actually needs it rather than
+        happening at import. By default every request returns a copy of the cached model, so that processes which
+        change bounds or objectives do not interfere with each other.
+    """
+    def __init__(self):
+        self._models: Dict[str, cobra.Model] = {}
+
+    def get(self, model_file: str, copy: bool = True) -> cobra.Model:
+        """Return the model for `model_file` (as accepted by `load_cobra_model`), loading it only on the first
+            request. If `copy` is False, the cached model itself is returned and shared with every other such caller.
+        """
+        if not isinstance(model_file, str):
+            raise ValueError('Invalid model file')
+        model = self._models.get(model_file)
+        if model is None:
+            model = self._models[model_file] = load_cobra_model(model_file)
+        return model.copy() if copy else model
+
+    def clear(self) -> None:
+        self._models.clear()
+
+
+COBRA_MODELS = CobraModelProvider()
+
+
+# -- process-pool parallel FBA --
+
+_FBA_WORKER = {}
+
+
+def _init_fba_worker(
+        model_file: str,
+        bounds: Dict,
+        biomass_reaction: str,
+        exchange_reactions: List[str],
+        incremental_solve: bool = True
+) -> None:
+    model = COBRA_MODELS.get(model_file, copy=False)
+    for reaction_id, reaction_bounds in bounds.items():
+        if reaction_bounds['lower'] is not None:
+            model.reactions.get_by_id(reaction_id).lower_bound = reaction_bounds['lower']
+        if reaction_bounds['upper'] is not None:
+            model.reactions.get_by_id(reaction_id).upper_bound = reaction_bounds['upper']
+
+    _FBA_WORKER['model'] = model
+    _FBA_WORKER['fba'] = IncrementalFBA(model, [biomass_reaction, *exchange_reactions]) if incremental_solve else None
+    _FBA_WORKER['biomass_reaction'] = biomass_reaction
+    _FBA_WORKER['exchange_reactions'] = exchange_reactions
+    _FBA_WORKER['shared_memory'] = {}
+
+
+def _attach_shared_memory(*names: str) -> List[shared_memory.SharedMemory]:
+    """Attach the blocks `names`, closing the attachments of blocks the pool has since released."""
+    attached = _FBA_WORKER['shared_memory']
+    for name in [name for name in attached if name not in names]:
+        attached.pop(name).close()
+    for name in names:
+        if name not in attached:
+            attached[name] = shared_memory.SharedMemory(name=name)
+    return [attached[name] for name in names]
+
+
+def _solve_fba_row(lower_bounds: Dict[str, float]) -> Optional[Dict[str, float]]:
+    fba = _FBA_WORKER['fba']
+    if fba is not None:
+        fba.set_lower_bounds(lower_bounds)
+        return fba.solve()
+
+    model = _FBA_WORKER['model']
+    for reaction_id, lower_bound in lower_bounds.items():
+        model.reactions.get_by_id(reaction_id).lower_bound = lower_bound
+    solution = model.optimize()
+    if solution.status != 'optimal':
+        return None
+    return {
+        reaction_id: solution.fluxes[reaction_id]
+        for reaction_id in [_FBA_WORKER['biomass_reaction'], *_FBA_WORKER['exchange_reactions']]}
+
+
+def _solve_fba_shard(bounds_name: str, results_name: str, shape: Tuple[int, int], start: int, stop: int) -> int:
+    n_rows, n_exchanges = shape
+    bounds_shm, results_shm = _attach_shared_memory(bounds_name, results_name)
+    bounds = np.ndarray(shape, dtype=np.float64, buffer=bounds_shm.buf)
+    results = np.ndarray((n_rows, 2 + 2 * n_exchanges), dtype=np.float64, buffer=results_shm.buf)
+
+    model = _FBA_WORKER['model']
+    exchange_reactions = _FBA_WORKER['exchange_reactions']
+    unique_bounds, inverse = np.unique(bounds[start:stop], axis=0, return_inverse=True)
+
+    # columns: feasible, growth rate, exchange fluxes, exchange reduced costs
+    solved = np.zeros((len(unique_bounds), 2 + 2 * n_exchanges))
+    for i, row in enumerate(unique_bounds):
+        fluxes = _solve_fba_row(dict(zip(exchange_reactions, row.tolist())))
+        if fluxes is not None:
+            solved[i, 0] = 1.0
+            solved[i, 1] = fluxes[_FBA_WORKER['biomass_reaction']]
+            solved[i, 2:2 + n_exchanges] = [fluxes[reaction_id] for reaction_id in exchange_reactions]
+            solved[i, 2 + n_exchanges:] = [
+                model.reactions.get_by_id(reaction_id).reduced_cost for reaction_id in exchange_reactions]
+
+    results[start:stop] = solved[inverse.reshape(-1)]
+    return stop - start
+
+
+def _release_shared_memory(blocks: Dict[str, shared_memory.SharedMemory]) -> None:
+    for shm in blocks.values():
+        shm.close()
+        shm.unlink()
+    blocks.clear()
+
+
+def _shutdown_fba_pool(executor: ProcessPoolExecutor, blocks: Dict[str, shared_memory.SharedMemory]) -> None:
+    executor.shutdown()
+    _release_shared_memory(blocks)
+
+
+class FBAPoolResults(NamedTuple):
+    growth_rates: np.ndarray
+    exchange_fluxes: np.ndarray
+    reduced_costs: np.ndarray
+    feasible: np.ndarray
+
+
+class ParallelFBAPool(object):
+    """Pool of worker processes which each hold a pre-loaded COBRA model and solve the FBA problems of a contiguous
+        shard of rows of a (rows × exchanges) lower bounds array.
+
+        The bounds and the results are exchanged through two shared memory blocks, reused for as long as the shape of
+        the bounds does not change, so that only the block names and the shard limits are pickled for each task.
+        Each worker writes the feasibility, growth rate, exchange fluxes and exchange reduced costs of its rows in
+        place, which keeps the results in row order regardless of which worker finishes first.
+
+        The workers and the blocks are released by `close`, or when the pool is garbage collected or the interpreter
+        exits, whichever comes first.
+
+        Args:
+            model_file:`str`: model to load in each worker, as accepted by `load_cobra_model`.
+            biomass_reaction:`str`: id of the biomass reaction.
+            exchange_reactions:`List[str]`: ids of the exchange reactions whose lower bounds are set, in column order.
+            bounds:`Optional[Dict]`: fixed bounds, as in the `DynamicFBA` config.
+            num_workers:`Optional[int]`: number of worker processes. Defaults to the number of CPUs.
+            incremental_solve:`bool`: whether the workers solve with `IncrementalFBA` or with `cobra.Model.optimize`.
+    """
+    def __init__(
+            self,
+            model_file: str,
+            biomass_reaction: str,
+            exchange_reactions: List[str],
+            bounds: Optional[Dict] = None,
+            num_workers: Optional[int] = None,
+            incremental_solve: bool = True
+    ):
+        self.num_workers = num_workers or os.cpu_count()
+        self.exchange_reactions = list(exchange_reactions)
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.num_workers,
+            initializer=_init_fba_worker,
+            initargs=(model_file, bounds or {}, biomass_reaction, self.exchange_reactions, incremental_solve))
+        self._shape = None
+        self._blocks: Dict[str, shared_memory.SharedMemory] = {}
+        self._finalizer = weakref.finalize(self, _shutdown_fba_pool, self.executor, self._blocks)
+
+    @property
+    def shared_memory_names(self) -> List[str]:
+        return [shm.name for shm in self._blocks.values()]
+
+    def _allocate(self, shape: Tuple[int, int]) -> None:
+        if shape == self._shape:
+            return
+        _release_shared_memory(self._blocks)
+        self._shape = None
+        n_rows, n_exchanges = shape
+        self._blocks['bounds'] = shared_memory.SharedMemory(create=True, size=max(n_rows * n_exchanges * 8, 8))
+        self._blocks['results'] = shared_memory.SharedMemory(create=True, size=max(n_rows * (2 + 2 * n_exchanges) * 8, 8))
+        self._shape = shape
+
+    def solve(self, lower_bounds: np.ndarray) -> FBAPoolResults:
+        """Return the growth rates (rows), exchange fluxes and reduced costs (rows × exchanges) and feasibility (rows)
+            solved for every row of `lower_bounds`. Infeasible rows get zero fluxes.
+        """
+        if not self._finalizer.alive:
+            raise RuntimeError('The pool has been closed.')
+        lower_bounds = np.ascontiguousarray(lower_bounds, dtype=np.float64)
+        shape = lower_bounds.shape
+        self._allocate(shape)
+        n_rows, n_exchanges = shape
+        bounds_shm, results_shm = self._blocks['bounds'], self._blocks['results']
+        np.ndarray(shape, dtype=np.float64, buffer=bounds_shm.buf)[:] = lower_bounds
+
+        edges = np.linspace(0, n_rows, min(self.num_workers, n_rows) + 1, dtype=int)
+        futures = [
+            self.executor.submit(_solve_fba_shard, bounds_shm.name, results_shm.name, shape, start, stop)
+            for start, stop in zip(edges[:-1].tolist(), edges[1:].tolist())
+            if stop > start]
+        for future in futures:
+            future.result()
+
+        results = np.ndarray((n_rows, 2 + 2 * n_exchanges), dtype=np.float64, buffer=results_shm.buf).copy()
+        return FBAPoolResults(
+            growth_rates=results[:, 1],
+            exchange_fluxes=results[:, 2:2 + n_exchanges],
+            reduced_costs=results[:, 2 + n_exchanges:],
+            feasible=results[:, 0].astype(bool))
+
+    def close(self) -> None:
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
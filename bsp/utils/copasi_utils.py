@@ -0,0 +1,377 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from time import perf_counter
+from typing import List, Dict, Optional, Iterable, Callable
+
+import numpy as np
+import COPASI
+from basico import load_model, load_model_from_string, save_model_to_string
+
+
+class CopasiStateExchange(object):
+    """Bulk state exchange between a COPASI model and NumPy vectors.
+
+        The metabolite and reaction objects of the model are resolved once in the constructor. Reading or writing
+        concentrations, particle numbers and fluxes is then a single pass over the cached object references rather
+        than a `basico.get_species`/`basico.get_reactions` DataFrame per name.
+
+        Args:
+            model:`COPASI.CDataModel`: model as returned by `basico.load_model` and friends.
+            species_names:`Optional[List[str]]`: species (by name) to expose. Defaults to all model species.
+            reaction_names:`Optional[List[str]]`: reactions (by name) to expose. Defaults to all model reactions.
+            parameter_names:`Optional[List[str]]`: global parameters (by name) to expose. Defaults to all global parameters.
+    """
+    def __init__(
+            self,
+            model,
+            species_names: Optional[List[str]] = None,
+            reaction_names: Optional[List[str]] = None,
+            parameter_names: Optional[List[str]] = None
+    ):
+        self.data_model = model
+        self.copasi_model = model.getModel()
+
+        metabolites = {}
+        for i in range(self.copasi_model.getMetabolites().size()):
+            metab = self.copasi_model.getMetabolite(i)
+            metabolites[metab.getObjectName()] = metab
+
+        reactions = {}
+        for i in range(self.copasi_model.getReactions().size()):
+            reaction = self.copasi_model.getReaction(i)
+            reactions[reaction.getObjectName()] = reaction
+
+        model_values = {}
+        for i in range(self.copasi_model.getModelValues().size()):
+            model_value = self.copasi_model.getModelValue(i)
+            model_values[model_value.getObjectName()] = model_value
+
+        self.species_names: List[str] = list(species_names) if species_names is not None else list(metabolites.keys())
+        self.reaction_names: List[str] = list(reaction_names) if reaction_names is not None else list(reactions.keys())
+        self.parameter_names: List[str] = list(parameter_names) if parameter_names is not None else list(model_values.keys())
+        self.metabolites = [metabolites[name] for name in self.species_names]
+        self.reactions = [reactions[name] for name in self.reaction_names]
+        self.model_values = [model_values[name] for name in self.parameter_names]
+        self.species_index: Dict[str, int] = {name: i for i, name in enumerate(self.species_names)}
+        self.parameter_index: Dict[str, int] = {name: i for i, name in enumerate(self.parameter_names)}
+
+        # every species, global quantity and compartment, whatever is exposed, to save and restore a full model state
+        compartments = [self.copasi_model.getCompartment(i) for i in range(self.copasi_model.getCompartments().size())]
+        self.entities = [*metabolites.values(), *model_values.values(), *compartments]
+
+    # -- reads --
+
+    def get_concentrations(self) -> np.ndarray:
+        return np.fromiter((m.getConcentration() for m in self.metabolites), dtype=float, count=len(self.metabolites))
+
+    def get_particle_numbers(self) -> np.ndarray:
+        return np.fromiter((m.getValue() for m in self.metabolites), dtype=float, count=len(self.metabolites))
+
+    def get_initial_concentrations(self) -> np.ndarray:
+        return np.fromiter((m.getInitialConcentration() for m in self.metabolites), dtype=float, count=len(self.metabolites))
+
+    def get_initial_particle_numbers(self) -> np.ndarray:
+        return np.fromiter((m.getInitialValue() for m in self.metabolites), dtype=float, count=len(self.metabolites))
+
+    def get_fluxes(self) -> np.ndarray:
+        return np.fromiter((r.getFlux() for r in self.reactions), dtype=float, count=len(self.reactions))
+
+    def get_initial_parameter_values(self) -> np.ndarray:
+        return np.fromiter((p.getInitialValue() for p in self.model_values), dtype=float, count=len(self.model_values))
+
+    def get_entity_values(self) -> np.ndarray:
+        """Current values of every entity (particle numbers, global quantity values and compartment sizes)."""
+        return np.fromiter((e.getValue() for e in self.entities), dtype=float, count=len(self.entities))
+
+    def get_initial_entity_values(self) -> np.ndarray:
+        return np.fromiter((e.getInitialValue() for e in self.entities), dtype=float, count=len(self.entities))
+
+    # -- writes --
+
+    def set_initial_concentrations(self, values: Iterable[float], indices: Optional[Iterable[int]] = None) -> None:
+        """Set the initial concentrations of the exposed species (or of `indices` only) and propagate them
+            through the model in a single `updateInitialValues` call.
+        """
+        change_set = COPASI.ObjectStdVector()
+        for i, value in self._indexed(values, indices):
+            metab = self.metabolites[i]
+            metab.setInitialConcentration(float(value))
+            change_set.append(metab.getInitialConcentrationReference())
+        self.copasi_model.updateInitialValues(change_set)
+
+    def set_initial_particle_numbers(self, values: Iterable[float], indices: Optional[Iterable[int]] = None) -> None:
+        """Set the initial particle numbers of the exposed species (or of `indices` only) and propagate them
+            through the model in a single `updateInitialValues` call.
+        """
+        change_set = COPASI.ObjectStdVector()
+        for i, value in self._indexed(values, indices):
+            metab = self.metabolites[i]
+            metab.setInitialValue(float(value))
+            change_set.append(metab.getInitialValueReference())
+        self.copasi_model.updateInitialValues(change_set)
+
+    def set_initial_parameter_values(self, values: Iterable[float], indices: Optional[Iterable[int]] = None) -> None:
+        change_set = COPASI.ObjectStdVector()
+        for i, value in self._indexed(values, indices):
+            model_value = self.model_values[i]
+            model_value.setInitialValue(float(value))
+            change_set.append(model_value.getInitialValueReference())
+        self.copasi_model.updateInitialValues(change_set)
+
+    def set_initial_entity_values(self, values: Iterable[float]) -> None:
+        """Set the initial values of every entity, as read by `get_entity_values`, in a single `updateInitialValues`
+            call, which restores a full model state.
+        """
+        change_set = COPASI.ObjectStdVector()
+        for entity, value in zip(self.entities, values):
+            entity.setInitialValue(float(value))
+            change_set.append(entity.getInitialValueReference())
+        self.copasi_model.updateInitialValues(change_set)
+
+    def set_initial_state(self, values: Iterable[float], use_counts: bool = False, indices: Optional[Iterable[int]] = None) -> None:
+        if use_counts:
+            return self.set_initial_particle_numbers(values, indices)
+        return self.set_initial_concentrations(values, indices)
+
+    def get_state(self, use_counts: bool = False) -> np.ndarray:
+        return self.get_particle_numbers() if use_counts else self.get_concentrations()
+
+    def get_initial_state(self, use_counts: bool = False) -> np.ndarray:
+        return self.get_initial_particle_numbers() if use_counts else self.get_initial_concentrations()
+
+    def set_species_values(self, species_values: Dict[str, float], use_counts: bool = False) -> None:
+        """Set initial values from a `{species_name: value}` port value, which may hold any subset of the species."""
+        indices = [self.species_index[name] for name in species_values.keys()]
+        return self.set_initial_state(species_values.values(), use_counts=use_counts, indices=indices)
+
+    # -- conversions --
+
+    def species_vector(self, species_values: Dict[str, float]) -> np.ndarray:
+        """Order a `{species_name: value}` port value as a vector aligned with `self.species_names`."""
+        return np.fromiter((species_values[name] for name in self.species_names), dtype=float, count=len(self.species_names))
+
+    def species_dict(self, values: np.ndarray) -> Dict[str, float]:
+        return dict(zip(self.species_names, values.tolist()))
+
+    def reactions_dict(self, values: np.ndarray) -> Dict[str, float]:
+        return dict(zip(self.reaction_names, values.tolist()))
+
+    @staticmethod
+    def _indexed(values, indices):
+        if indices is None:
+            return enumerate(values)
+        return zip(indices, values)
+
+
+# -- time course stepping --
+
+COPASI_METHODS = {
+    'deterministic': COPASI.CTaskEnum.Method_deterministic,
+    'lsoda': COPASI.CTaskEnum.Method_deterministic,
+    'radau5': COPASI.CTaskEnum.Method_RADAU5,
+    'stochastic': COPASI.CTaskEnum.Method_stochastic,
+    'gibson': COPASI.CTaskEnum.Method_stochastic,
+    'directmethod': COPASI.CTaskEnum.Method_directMethod,
+    'tauleap': COPASI.CTaskEnum.Method_tauLeap,
+    'adaptivesa': COPASI.CTaskEnum.Method_adaptiveSA,
+    'hybrid': COPASI.CTaskEnum.Method_hybrid,
+    'hybridlsoda': COPASI.CTaskEnum.Method_hybridLSODA,
+    'hybridode45': COPASI.CTaskEnum.Method_hybridODE45,
+    'sde': COPASI.CTaskEnum.Method_stochasticRunkeKuttaRI5,
+}
+
+
+class CopasiTimeCourseEngine(object):
+    """Persistent COPASI time course task which is configured once and then advanced interval by interval.
+
+        `basico.run_time_course` re-configures the trajectory task, the method and the integrator on every call. This
+        engine initializes the `CTrajectoryTask` once and then only calls `processStep`, restarting the integrator
+        (`processStart`) only when the state has been changed from the outside since the last step, ie: when
+        `apply_state` wrote a non-zero delta or the requested start time does not match the engine time.
+
+        Args:
+            model:`COPASI.CDataModel`: model to advance.
+            state_exchange:`CopasiStateExchange`: bulk io object for the same `model`.
+            method:`str`: method name as accepted by `basico.run_time_course`. Defaults to `'deterministic'`.
+            use_counts:`bool`: whether the exchanged state is in particle numbers rather than concentrations.
+    """
+    def __init__(self, model, state_exchange: CopasiStateExchange, method: str = 'deterministic', use_counts: bool = False):
+        setup_start = perf_counter()
+        self.data_model = model
+        self.copasi_model = model.getModel()
+        self.state_exchange = state_exchange
+        self.use_counts = use_counts
+
+        self.task = self.data_model.getTask('Time-Course')
+        self.task.setMethodType(COPASI_METHODS.get(method.lower(), COPASI.CTaskEnum.Method_deterministic))
+        self.task.setUpdateModel(True)
+        problem = self.task.getProblem()
+        problem.setStepNumber(1)
+        problem.setTimeSeriesRequested(False)
+        problem.setOutputEvent(False)
+        self.task.initialize(COPASI.CCopasiTask.NO_OUTPUT, self.data_model, None)
+
+        self.time = self.copasi_model.getInitialTime()
+        self._restart_required = True
+        self.setup_time = perf_counter() - setup_start
+        self.timings: List[Dict[str, float]] = []
+
+    def apply_state(self, species_values: Dict[str, float]) -> int:
+        """Write only those species values which differ from the current model state. Returns the number
+            of changed species.
+        """
+        current = self.get_state()
+        indices = np.fromiter(
+            (self.state_exchange.species_index[name] for name in species_values.keys()),
+            dtype=int,
+            count=len(species_values))
+        values = np.fromiter(species_values.values(), dtype=float, count=len(species_values))
+        changed = np.flatnonzero(current[indices] != values)
+        if changed.size:
+            self.state_exchange.set_initial_state(values[changed], use_counts=self.use_counts, indices=indices[changed].tolist())
+            self._restart_required = True
+
+        return int(changed.size)
+
+    def require_restart(self) -> None:
+        """Flag that the model state was changed outside of `apply_state`, ie: directly through the state exchange."""
+        self._restart_required = True
+
+    def get_state(self) -> np.ndarray:
+        """Current species state. The task is restored with `updateModel` after each step, so the final state of
+            the last interval is held in the model's initial values.
+        """
+        return self.state_exchange.get_initial_state(use_counts=self.use_counts)
+
+    def advance(self, start_time: float, interval: float) -> Dict[str, float]:
+        """Advance the model from `start_time` by `interval` and return the timing of this step."""
+        setup_start = perf_counter()
+        if self._restart_required or start_time != self.time:
+            self.copasi_model.setInitialTime(start_time)
+            self.task.processStart(True)
+            self.time = start_time
+            self._restart_required = False
+        setup = perf_counter() - setup_start
+
+        integration_start = perf_counter()
+        self.task.processStep(self.time + interval, True)
+        # push the final state into the model (and its initial values, as `update_model` would)
+        self.task.restore(True)
+        integration = perf_counter() - integration_start
+
+        self.time += interval
+        timing = {'setup': setup, 'integration': integration}
+        self.timings.append(timing)
+
+        return timing
+
+    def timing_summary(self) -> Dict[str, float]:
+        setup = sum(t['setup'] for t in self.timings)
+        integration = sum(t['integration'] for t in self.timings)
+        return {
+            'initial_setup': self.setup_time,
+            'setup': setup,
+            'integration': integration,
+            'steps': len(self.timings)
+        }
+
+
+# -- model loading --
+
+class CopasiModelCache(object):
+    """Process-wide, content-addressed cache of parsed COPASI models.
+
+        Models are keyed by the SHA-256 of the model file content plus the model changes applied to it, so that
+        renamed/copied files share an entry and edited files do not. Each entry holds a `.cps` snapshot of the
+        parsed (and changed) model; a hit returns a fresh clone loaded from that snapshot, which skips SBML import
+        entirely. Entries are evicted least-recently-used once more than `max_size` models are held.
+
+        Args:
+            max_size:`int`: maximum number of snapshots held in memory. Defaults to `32`.
+            cache_dir:`Optional[str]`: directory in which to persist `.cps` snapshots across interpreter runs.
+                Defaults to `None`, which keeps snapshots in memory only.
+    """
+    def __init__(self, max_size: int = 32, cache_dir: Optional[str] = None):
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        self._snapshots: OrderedDict[str, str] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def model_key(model_source: str, model_changes: Optional[Dict] = None) -> str:
+        digest = hashlib.sha256()
+        with open(model_source, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        if model_changes:
+            digest.update(json.dumps(model_changes, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def get(self, model_source: str, model_changes: Optional[Dict] = None, on_load: Optional[Callable] = None):
+        """Return a model for `model_source`, cloned from a cached snapshot if one exists.
+
+            Args:
+                model_source:`str`: path to the SBML/COPASI model file.
+                model_changes:`Optional[Dict]`: model changes which are part of the cache key.
+                on_load:`Optional[Callable]`: called with the freshly loaded model on a cache miss, ie: to apply
+                    `model_changes`, before the snapshot is taken.
+        """
+        key = self.model_key(model_source, model_changes)
+        snapshot = self._get_snapshot(key)
+        if snapshot is not None:
+            self.hits += 1
+            return load_model_from_string(snapshot)
+
+        self.misses += 1
+        model = load_model(model_source)
+        if on_load is not None:
+            on_load(model)
+        self._put_snapshot(key, save_model_to_string(model=model))
+
+        return model
+
+    def clear(self) -> None:
+        self._snapshots.clear()
+
+    def _snapshot_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f'{key}.cps')
+
+    def _get_snapshot(self, key: str) -> Optional[str]:
+        snapshot = self._snapshots.get(key)
+        if snapshot is not None:
+            self._snapshots.move_to_end(key)
+        elif self.cache_dir is not None and os.path.exists(self._snapshot_path(key)):
+            with open(self._snapshot_path(key), 'r') as f:
+                snapshot = f.read()
+            self._store(key, snapshot)
+
+        return snapshot
+
+    def _put_snapshot(self, key: str, snapshot: str) -> None:
+        self._store(key, snapshot)
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # write then rename so that concurrent readers never see a partial snapshot
+            tmp_path = f'{self._snapshot_path(key)}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write(snapshot)
+            os.replace(tmp_path, self._snapshot_path(key))
+
+    def _store(self, key: str, snapshot: str) -> None:
+        self._snapshots[key] = snapshot
+        self._snapshots.move_to_end(key)
+        while len(self._snapshots) > self.max_size:
+            self._snapshots.popitem(last=False)
+
+
+COPASI_MODEL_CACHE = CopasiModelCache(
+    max_size=int(os.getenv('BSP_COPASI_CACHE_SIZE', 32)),
+    cache_dir=os.getenv('BSP_COPASI_CACHE_DIR'))
+
+
+def load_cached_model(model_source: str, model_changes: Optional[Dict] = None, on_load: Optional[Callable] = None):
+    """Load `model_source` through the process-wide `COPASI_MODEL_CACHE`."""
+    return COPASI_MODEL_CACHE.get(model_source, model_changes=model_changes, on_load=on_load)
@@ -0,0 +1,85 @@
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+
+class DiffusionModel(object):
+    """Force-dependent diffusion coefficients, evaluated with NumPy for every species (and region) at once.
+
+        The coefficient of species s at a distance d from the membrane is
+
+            D_s = D0_s * exp(-alpha * exp(-beta * d) * |F|)
+
+        where |F| is the (Frobenius) magnitude of the membrane forces, as in `compute_kth_difc`. The forces are
+        converted to an array and reduced to per-vertex magnitudes once per `set_forces` call, and reused by every
+        evaluation until the next one.
+
+        Args:
+            base_difc:`Union[Sequence[float], np.ndarray]`: force-free diffusion coefficient of each species.
+            alpha:`float`: membrane vertex force sensitivity constant.
+            beta:`float`: decay of the force sensitivity with the distance from the membrane.
+    """
+    def __init__(self, base_difc: Union[Sequence[float], np.ndarray], alpha: float = 0.3, beta: float = 1.0):
+        self.base_difc = np.asarray(base_difc, dtype=float)
+        self.alpha = alpha
+        self.beta = beta
+        self.forces = np.empty((0, 3), dtype=float)
+        self.vertex_magnitudes = np.empty(0, dtype=float)
+        self.force_magnitude = 0.0
+
+    def set_forces(self, forces) -> None:
+        """Cache the force array (vertices x dim) and its magnitudes."""
+        forces = np.asarray(forces, dtype=float)
+        self.forces = forces.reshape(-1, forces.shape[-1]) if forces.size else np.empty((0, 3), dtype=float)
+        self.vertex_magnitudes = np.linalg.norm(self.forces, axis=1)
+        self.force_magnitude = float(np.sqrt(np.sum(self.vertex_magnitudes ** 2)))
+
+    def _coefficients(self, force_magnitude: np.ndarray, distance: Union[float, np.ndarray]) -> np.ndarray:
+        alpha_scaled = self.alpha * np.exp(-self.beta * np.asarray(distance, dtype=float))
+        exponent = -alpha_scaled * np.asarray(force_magnitude, dtype=float)
+        return self.base_difc.reshape((-1,) + (1,) * exponent.ndim) * np.exp(exponent)
+
+    def coefficients(self, distance: Union[float, np.ndarray] = 0.0) -> np.ndarray:
+        """Coefficients of every species under the total force, shaped (species,) for a scalar distance or
+            (species, *distance.shape) for an array of distances.
+        """
+        return self._coefficients(np.full(np.shape(distance), self.force_magnitude), distance)
+
+    def region_coefficients(
+            self,
+            vertices,
+            n_bins: Tuple[int, ...],
+            bounds: Optional[Tuple[Sequence[float], Sequence[float]]] = None,
+            distance: Union[float, np.ndarray] = 0.0
+    ) -> np.ndarray:
+        """Coefficients of every species in each region of a grid, shaped (species, *n_bins), each region being
+            subject to the magnitude of the forces of the vertices which lie within it.
+
+            Args:
+                vertices:`array-like`: membrane vertex coordinates (vertices x dim), in the order of the forces.
+                n_bins:`Tuple[int, ...]`: number of regions along each axis.
+                bounds:`Optional[Tuple]`: (low, high) corners of the grid. Defaults to the extent of the vertices.
+                distance:`Union[float, np.ndarray]`: distance from the membrane, either scalar or shaped as `n_bins`.
+        """
+        vertices = np.asarray(vertices, dtype=float)[:, :len(n_bins)]
+        if bounds is None:
+            bounds = (vertices.min(axis=0), vertices.max(axis=0))
+        ranges = list(zip(bounds[0], bounds[1]))
+
+        squared_magnitudes, _ = np.histogramdd(vertices, bins=n_bins, range=ranges, weights=self.vertex_magnitudes ** 2)
+        return self._coefficients(np.sqrt(squared_magnitudes), distance)
+
+    @staticmethod
+    def apply(simulation, species_names: List[str], coefficients: Dict) -> None:
+        """Set the diffusion coefficient of each species in each molecule state through
+            `Simulation.setSpeciesMobility`, which Smoldyn then applies to every molecule without a Python callback.
+
+            Args:
+                simulation:`smoldyn.Simulation`: simulation to update.
+                species_names:`List[str]`: species names, in the order of the coefficients.
+                coefficients:`Dict[MolecState, np.ndarray]`: coefficients (species,) per molecule state, for example
+                    solution molecules at a distance from the membrane and surface-bound ones at the membrane.
+        """
+        for state, state_coefficients in coefficients.items():
+            for name, difc in zip(species_names, np.asarray(state_coefficients, dtype=float).tolist()):
+                simulation.setSpeciesMobility(name, state, difc)
@@ -1,14 +1,17 @@
 from typing import Dict, Union, List, Tuple
 from types import FunctionType
+from tempfile import mkdtemp
 import os
 
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
-from basico import biomodels, load_model_from_string
+from basico import biomodels
 from process_bigraph import Composite, pf, pp, ProcessTypes
 import nbformat
 
+from bsp.io import BIOMODEL_STORE, biomodels_offline
+
 
 def check_ode_kisao_term(term: str):
     """Check that a term is representative an ODE algorithm."""
@@ -233,8 +236,23 @@ def fetch_biomodel_by_term(term: str, index: int = 0):
 
 def fetch_biomodel(model_id: str):
     # TODO: make this generalizable for those other than basico
-    sbml = biomodels.get_content_for_model(model_id)
-    return load_model_from_string(sbml)
+    # imported here so that importing the helpers does not import COPASI
+    from bsp.utils.copasi_utils import load_cached_model
+
+    # consult the local BioModels mirror before the BioModels API
+    model_fp = BIOMODEL_STORE.get(model_id)
+    if model_fp is None:
+        if biomodels_offline():
+            raise FileNotFoundError(f'{model_id} is not in the local BioModels store at {BIOMODEL_STORE.root} and BSP_OFFLINE is set.')
+        sbml = biomodels.get_content_for_model(model_id)
+        model_fp = BIOMODEL_STORE.try_add(model_id, sbml)
+        if model_fp is None:
+            # the store is not writable: load the model from a temporary copy
+            model_fp = os.path.join(mkdtemp(), f'{model_id}.xml')
+            with open(model_fp, 'w' if isinstance(sbml, str) else 'wb') as f:
+                f.write(sbml)
+
+    return load_cached_model(model_fp)
 
 
 def play_composition(instance: dict, duration: int):
@@ -0,0 +1,449 @@
+import os
+from typing import Dict, List, Iterator, Mapping, Optional, Tuple, Union
+
+import numpy as np
+
+
+# columns of each row written by the Smoldyn `listmols2` command
+LISTMOLS2_COLUMNS = ('time', 'species_index', 'state', 'x', 'y', 'z', 'serial')
+
+
+class ParticleArrays(object):
+    """Columnar view over the rows written by the Smoldyn `listmols2` command.
+
+        The rows are converted once into a single (N, 7) float array, and every column is exposed as a NumPy view or
+        cast of it, so that no per-molecule Python object is created. `as_dict_view` provides dict-style access to
+        individual particles for the consumers which need it, building each particle dict only when it is accessed.
+
+        Args:
+            data:`Union[np.ndarray, List[List[float]]]`: `listmols2` rows: [time, species index (1-based), state,
+                x, y, z, serial number].
+            species_names:`List[str]`: species names ordered by Smoldyn species index, less the empty species.
+    """
+    def __init__(self, data: Union[np.ndarray, List[List[float]]], species_names: List[str]):
+        self.data = np.asarray(data, dtype=float).reshape(-1, len(LISTMOLS2_COLUMNS))
+        self.species_names = species_names
+
+    def __len__(self) -> int:
+        return self.data.shape[0]
+
+    @property
+    def time(self) -> np.ndarray:
+        return self.data[:, 0]
+
+    @property
+    def species_index(self) -> np.ndarray:
+        """0-based index of each particle's species within `species_names`."""
+        return self.data[:, 1].astype(np.int32) - 1
+
+    @property
+    def state(self) -> np.ndarray:
+        return self.data[:, 2].astype(np.int32)
+
+    @property
+    def coordinates(self) -> np.ndarray:
+        return self.data[:, 3:6]
+
+    @property
+    def serial(self) -> np.ndarray:
+        return self.data[:, 6].astype(np.int64)
+
+    def last_frame(self) -> 'ParticleArrays':
+        """Particles listed at the latest time, as `listmols2` appends a frame at every step of a run."""
+        if not len(self):
+            return self
+        return ParticleArrays(self.data[self.time == self.time.max()], self.species_names)
+
+    def to_dict(self) -> Dict[str, np.ndarray]:
+        return {
+            'coordinates': self.coordinates,
+            'species_index': self.species_index,
+            'state': self.state,
+            'serial': self.serial
+        }
+
+    def as_dict_view(self) -> 'ParticleDictView':
+        return ParticleDictView(self)
+
+
+class ParticleDictView(Mapping):
+    """Read-only mapping of serial number (as a string) to `{'coordinates', 'species_id', 'state'}` particle dicts,
+        built lazily from a `ParticleArrays`.
+    """
+    def __init__(self, particles: ParticleArrays):
+        self.particles = particles
+        self._rows = None
+
+    @property
+    def rows(self) -> Dict[str, int]:
+        if self._rows is None:
+            self._rows = {str(serial): row for row, serial in enumerate(self.particles.serial.tolist())}
+        return self._rows
+
+    def __getitem__(self, key: str) -> Dict:
+        row = self.rows[key]
+        return {
+            'coordinates': self.particles.coordinates[row].tolist(),
+            'species_id': self.particles.species_names[int(self.particles.data[row, 1]) - 1],
+            'state': int(self.particles.data[row, 2])
+        }
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.rows)
+
+    def __len__(self) -> int:
+        return len(self.particles)
+
+
+class ParticleIndex(object):
+    """Persistent index of particles keyed by Smoldyn serial number, used to follow particles between steps.
+
+        `update` compares a new frame with the indexed one and returns only the particles which were added, removed,
+        or which moved by more than `tolerance` or changed species or state, so that the size of the emitted update
+        scales with the change rather than with the population.
+
+        Particles which are re-created with new serial numbers by the caller (e.g. killed and re-added to move them)
+        can no longer be followed: `forget` drops their serials from the index, and the next `update` reports them
+        under 'dropped' rather than 'removed', while their replacements are reported as added.
+
+        Args:
+            tolerance:`float`: displacement below which a particle is not reported as moved.
+    """
+    def __init__(self, tolerance: float = 0.0):
+        self.tolerance = tolerance
+        self.serial = np.empty(0, dtype=np.int64)
+        self.coordinates = np.empty((0, 3), dtype=float)
+        self.species_index = np.empty(0, dtype=np.int32)
+        self.state = np.empty(0, dtype=np.int32)
+        self.dropped = np.empty(0, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return self.serial.shape[0]
+
+    def __contains__(self, serial: int) -> bool:
+        return bool(np.isin(serial, self.serial))
+
+    def forget(self, rows: np.ndarray) -> None:
+        """Drop the indexed particles selected by `rows` (a boolean mask or indices) from tracking."""
+        keep = np.ones(len(self), dtype=bool)
+        keep[rows] = False
+        self.dropped = np.concatenate([self.dropped, self.serial[~keep]])
+        self.serial = self.serial[keep]
+        self.coordinates = self.coordinates[keep]
+        self.species_index = self.species_index[keep]
+        self.state = self.state[keep]
+
+    @staticmethod
+    def _rows(particles: ParticleArrays, rows: np.ndarray) -> Dict[str, np.ndarray]:
+        return {
+            'serial': particles.serial[rows],
+            'coordinates': particles.coordinates[rows],
+            'species_index': particles.species_index[rows],
+            'state': particles.state[rows]
+        }
+
+    def update(self, particles: ParticleArrays) -> Dict[str, Dict[str, np.ndarray]]:
+        """Replace the indexed frame with `particles` and return the delta from the previous frame as
+            `{'added': {...}, 'moved': {...}, 'removed': {'serial': ...}, 'dropped': {'serial': ...}}`, each holding
+            columnar arrays.
+        """
+        serial = particles.serial
+        common, old_rows, new_rows = np.intersect1d(self.serial, serial, assume_unique=True, return_indices=True)
+
+        added = np.ones(len(serial), dtype=bool)
+        added[new_rows] = False
+        removed = np.ones(len(self.serial), dtype=bool)
+        removed[old_rows] = False
+
+        displacement = np.linalg.norm(particles.coordinates[new_rows] - self.coordinates[old_rows], axis=1)
+        changed = (displacement > self.tolerance) \
+            | (particles.species_index[new_rows] != self.species_index[old_rows]) \
+            | (particles.state[new_rows] != self.state[old_rows])
+
+        delta = {
+            'added': self._rows(particles, np.flatnonzero(added)),
+            'moved': self._rows(particles, new_rows[changed]),
+            'removed': {'serial': self.serial[removed]},
+            'dropped': {'serial': self.dropped}
+        }
+        self.dropped = np.empty(0, dtype=np.int64)
+
+        self.serial = serial
+        self.coordinates = particles.coordinates.copy()
+        self.species_index = particles.species_index
+        self.state = particles.state
+        return delta
+
+
+def reflect_into_bounds(coordinates: np.ndarray, low: np.ndarray, high: np.ndarray) -> np.ndarray:
+    """Mirror the coordinates (N x dim) lying outside of [low, high] back across the violated bound, clipping those
+        which would still lie outside (i.e. further from the bound than the width of the box).
+    """
+    low = np.asarray(low, dtype=float)
+    high = np.asarray(high, dtype=float)
+    reflected = np.where(coordinates < low, 2 * low - coordinates, coordinates)
+    reflected = np.where(reflected > high, 2 * high - reflected, reflected)
+    return np.clip(reflected, low, high)
+
+
+def out_of_bounds(coordinates: np.ndarray, low: np.ndarray, high: np.ndarray) -> np.ndarray:
+    return np.any((coordinates < np.asarray(low)) | (coordinates > np.asarray(high)), axis=1)
+
+
+# -- streaming reader for Smoldyn output files --
+
+LISTMOLS_DTYPE = np.dtype([
+    ('species', np.int32),
+    ('state', np.int32),
+    ('coordinates', np.float64, (3,)),
+    ('serial', np.int64)
+])
+
+# values of `smoldyn.MolecState`, by the state names written by Smoldyn
+MOLECULE_STATES = {'solution': 0, 'soln': 0, 'front': 1, 'back': 2, 'up': 3, 'down': 4, 'bsoln': 5}
+
+
+def _is_number(token: bytes) -> bool:
+    try:
+        float(token)
+        return True
+    except ValueError:
+        return False
+
+
+class SmoldynOutputReader(object):
+    """Streaming reader of Smoldyn output text files, which reads the file in chunks of `chunk_size` bytes, so that
+        its memory footprint is bounded by a chunk and a frame regardless of the file size.
+
+        In 'listmols' mode, the file is a sequence of frames, each made of a line starting with the time (as written by
+        `executiontime`) followed by one `listmols` line per molecule: its species name (optionally followed by its
+        state in parentheses), optionally its state, its coordinates and its serial number. Each frame is parsed into
+        a `LISTMOLS_DTYPE` structured array, whose species indices refer to `species_names`.
+
+        In 'molcount' mode, every line holds the time followed by the count of each species, and the file is parsed
+        into (rows x (1 + species)) float arrays, one per chunk.
+
+        The first complete read of the file writes a sidecar index (`<file>.<mode>.index.npz`) of the time and byte
+        offset of every frame (or chunk), and the species names and labels, so that later reads can seek to the start
+        of a time range directly. The index is rebuilt whenever the size or the modification time of the file changes. If the
+        sidecar cannot be written (e.g. next to a read-only output file), the index is kept in memory by the reader.
+
+        Args:
+            filepath:`str`: path to the Smoldyn output file.
+            mode:`str`: either 'listmols' or 'molcount'.
+            chunk_size:`int`: number of bytes read at once.
+    """
+    modes = ['listmols', 'molcount']
+
+    def __init__(self, filepath: str, mode: str = 'listmols', chunk_size: int = 1 << 20):
+        if mode not in self.modes:
+            raise ValueError(f'"{mode}" is not a valid mode. Choose one of {self.modes}.')
+        self.filepath = filepath
+        self.mode = mode
+        self.chunk_size = chunk_size
+        self.index_filepath = f'{filepath}.{mode}.index.npz'
+        self._species_names: List[str] = []
+        self._species_indices: Dict[str, int] = {}
+        self._molecule_labels: Dict[str, None] = {}
+        self._index: Optional[Dict[str, np.ndarray]] = None
+
+    # -- index --
+
+    def _file_signature(self) -> np.ndarray:
+        stat = os.stat(self.filepath)
+        return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+    def load_index(self) -> Optional[Dict[str, np.ndarray]]:
+        """Return the index if it exists and matches the current file, else None."""
+        signature = self._file_signature()
+        if self._index is not None and np.array_equal(self._index['signature'], signature):
+            return self._index
+        try:
+            with np.load(self.index_filepath) as index:
+                if not np.array_equal(index['signature'], signature) or 'molecule_labels' not in index.files:
+                    return None
+                self._index = {key: index[key] for key in index.files}
+        except (OSError, ValueError, KeyError):
+            return None
+        return self._index
+
+    def _write_index(self, times: List[float], offsets: List[int]) -> None:
+        self._index = {
+            'signature': self._file_signature(),
+            'times': np.asarray(times, dtype=float),
+            'offsets': np.asarray(offsets, dtype=np.int64),
+            'species_names': np.asarray(self._species_names, dtype=str),
+            'molecule_labels': np.asarray(list(self._molecule_labels), dtype=str)
+        }
+        tmp_filepath = f'{self.index_filepath}.{os.getpid()}.tmp.npz'
+        try:
+            np.savez(tmp_filepath, **self._index)
+            os.replace(tmp_filepath, self.index_filepath)
+        except OSError:
+            # carry on with the index in memory
+            if os.path.exists(tmp_filepath):
+                os.remove(tmp_filepath)
+
+    def build_index(self) -> Dict[str, np.ndarray]:
+        index = self.load_index()
+        if index is None:
+            for _ in self.iter_frames() if self.mode == 'listmols' else self.iter_counts():
+                pass
+            index = self.load_index()
+        return index
+
+    def species_names(self) -> List[str]:
+        """Names of the species listed in a 'listmols' file, in order of species index."""
+        return self.build_index()['species_names'].tolist()
+
+    def molecule_labels(self) -> List[str]:
+        """Species labels of a 'listmols' file as written, i.e. with their state suffix (e.g. 'a(front)'), in order of
+            first appearance.
+        """
+        return self.build_index()['molecule_labels'].tolist()
+
+    # -- chunked reading --
+
+    def _blocks(self, offset: int = 0) -> Iterator[Tuple[int, bytes]]:
+        """Yield (byte offset, block) pairs, each block holding whole lines and being at most about a chunk."""
+        with open(self.filepath, 'rb') as f:
+            f.seek(offset)
+            position = offset
+            remainder = b''
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    break
+                chunk = remainder + chunk
+                end = chunk.rfind(b'\n') + 1
+                if end == 0:
+                    remainder = chunk
+                    continue
+                yield position, chunk[:end]
+                position += end
+                remainder = chunk[end:]
+            if remainder.strip():
+                yield position, remainder
+
+    def _lines(self, offset: int = 0) -> Iterator[Tuple[int, bytes]]:
+        for position, block in self._blocks(offset):
+            for line in block.splitlines(keepends=True):
+                yield position, line
+                position += len(line)
+
+    def _species_index(self, name: str) -> int:
+        index = self._species_indices.get(name)
+        if index is None:
+            index = self._species_indices[name] = len(self._species_names)
+            self._species_names.append(name)
+        return index
+
+    def _parse_molecule(self, tokens: List[bytes]) -> Tuple:
+        species = tokens[0].decode()
+        self._molecule_labels.setdefault(species)
+        state = 0
+        if species.endswith(')') and '(' in species:
+            species, state_name = species[:-1].split('(', 1)
+            state = MOLECULE_STATES.get(state_name, 0)
+        values = tokens[1:]
+        if values and not _is_number(values[0]):
+            state = MOLECULE_STATES.get(values[0].decode(), 0)
+            values = values[1:]
+        values = [float(value) for value in values]
+        if len(values) > 4:
+            state = int(values[0])
+            values = values[1:]
+        coordinates = (values[:-1] + [0.0, 0.0, 0.0])[:3]
+        return self._species_index(species), state, coordinates, int(values[-1])
+
+    # -- listmols --
+
+    def _parse_frames(self, offset: int = 0) -> Iterator[Tuple[float, int, np.ndarray]]:
+        time = None
+        frame_offset = offset
+        rows = []
+        for line_offset, line in self._lines(offset):
+            tokens = line.split()
+            if not tokens:
+                continue
+            if _is_number(tokens[0]):
+                if time is not None or rows:
+                    yield time or 0.0, frame_offset, np.array(rows, dtype=LISTMOLS_DTYPE)
+                time = float(tokens[0])
+                frame_offset = line_offset
+                rows = []
+            else:
+                rows.append(self._parse_molecule(tokens))
+        if time is not None or rows:
+            yield time or 0.0, frame_offset, np.array(rows, dtype=LISTMOLS_DTYPE)
+
+    def _start(self, start_time: Optional[float], side: str) -> Tuple[int, bool]:
+        """Byte offset from which to read for `start_time`, and whether the read should build the index."""
+        index = self.load_index()
+        if index is None:
+            return 0, True
+
+        # keep the species indices consistent with those of the full read
+        self._species_names = index['species_names'].tolist()
+        self._species_indices = {name: i for i, name in enumerate(self._species_names)}
+        self._molecule_labels = dict.fromkeys(index['molecule_labels'].tolist())
+        if start_time is None or not len(index['times']):
+            return 0, False
+        i = np.searchsorted(index['times'], start_time, side=side) - (1 if side == 'right' else 0)
+        i = min(max(i, 0), len(index['times']) - 1)
+        return int(index['offsets'][i]), False
+
+    def iter_frames(
+            self,
+            start_time: Optional[float] = None,
+            end_time: Optional[float] = None
+    ) -> Iterator[Tuple[float, np.ndarray]]:
+        """Yield the (time, molecules) of every frame whose time lies within [start_time, end_time]."""
+        offset, build_index = self._start(start_time, side='left')
+        times, offsets = [], []
+        for time, frame_offset, molecules in self._parse_frames(offset):
+            if build_index:
+                times.append(time)
+                offsets.append(frame_offset)
+            if end_time is not None and time > end_time:
+                if not build_index:
+                    return
+                continue
+            if start_time is None or time >= start_time:
+                yield time, molecules
+        if build_index:
+            self._write_index(times, offsets)
+
+    # -- molcount --
+
+    def iter_counts(
+            self,
+            start_time: Optional[float] = None,
+            end_time: Optional[float] = None
+    ) -> Iterator[np.ndarray]:
+        """Yield (rows x (1 + species)) arrays of the counts whose time lies within [start_time, end_time], one per
+            chunk.
+        """
+        offset, build_index = self._start(start_time, side='right')
+        times, offsets = [], []
+        n_columns = None
+        for block_offset, block in self._blocks(offset):
+            lines = block.split(b'\n', 1)
+            if n_columns is None:
+                n_columns = len(lines[0].split())
+            counts = np.array(block.split(), dtype=float).reshape(-1, n_columns)
+            if build_index and len(counts):
+                times.append(counts[0, 0])
+                offsets.append(block_offset)
+
+            mask = np.ones(len(counts), dtype=bool)
+            if start_time is not None:
+                mask &= counts[:, 0] >= start_time
+            if end_time is not None:
+                mask &= counts[:, 0] <= end_time
+            if mask.any():
+                yield counts[mask]
+            elif end_time is not None and len(counts) and counts[0, 0] > end_time and not build_index:
+                return
+        if build_index:
+            self._write_index(times, offsets)
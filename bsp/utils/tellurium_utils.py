@@ -0,0 +1,154 @@
+import hashlib
+import os
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from urllib.parse import quote, unquote
+from typing import Optional, Union, Dict, List
+
+import tellurium as te
+
+
+class RoadRunnerCache(object):
+    """Process-wide cache of compiled RoadRunner models keyed by SBML/Antimony content.
+
+        `te.loadSBMLModel`/`te.loada` JIT-compile the model for every instance. This cache keeps the serialized state
+        (`saveStateS`) of the first instance loaded for a given model content and produces every further instance by
+        loading that state into a new `ExtendedRoadRunner`, which restores the compiled model rather than
+        recompiling it. Entries are evicted least-recently-used once their total size exceeds `max_bytes`.
+
+        Args:
+            max_bytes:`int`: upper bound on the total size of the cached serialized states.
+    """
+    def __init__(self, max_bytes: int = 256 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self._states: OrderedDict[str, bytes] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def size(self) -> int:
+        return sum(len(state) for state in self._states.values())
+
+    @staticmethod
+    def model_key(model_content: Union[str, bytes]) -> str:
+        if isinstance(model_content, str):
+            model_content = model_content.encode()
+        return hashlib.sha256(model_content).hexdigest()
+
+    def get(self, sbml_model_path: Optional[str] = None, antimony_string: Optional[str] = None):
+        """Return a RoadRunner instance for the given SBML file or Antimony string, cloned from the cache if the
+            same model content has been compiled before.
+        """
+        if sbml_model_path is not None:
+            with open(sbml_model_path, 'rb') as f:
+                key = self.model_key(f.read())
+        elif antimony_string is not None:
+            key = self.model_key(antimony_string)
+        else:
+            raise ValueError('You must pass either an "sbml_model_path" or an "antimony_string".')
+
+        state = self._states.get(key)
+        if state is not None:
+            self.hits += 1
+            self._states.move_to_end(key)
+            return self.clone(state)
+
+        self.misses += 1
+        simulator = te.loadSBMLModel(sbml_model_path) if sbml_model_path is not None else te.loada(antimony_string)
+        self._store(key, simulator.saveStateS())
+
+        return simulator
+
+    @staticmethod
+    def clone(state: bytes):
+        """Create a new RoadRunner instance from a serialized state."""
+        simulator = te.roadrunner.extended_roadrunner.ExtendedRoadRunner()
+        simulator.loadStateS(state)
+        return simulator
+
+    def clear(self) -> None:
+        self._states.clear()
+
+    def _store(self, key: str, state: bytes) -> None:
+        if len(state) > self.max_bytes:
+            return
+        self._states[key] = state
+        self._states.move_to_end(key)
+        while self.size > self.max_bytes:
+            self._states.popitem(last=False)
+
+
+ROADRUNNER_CACHE = RoadRunnerCache(max_bytes=int(os.getenv('BSP_ROADRUNNER_CACHE_MAX_BYTES', 256 * 1024 ** 2)))
+
+
+# -- checkpointing --
+
+class CheckpointStore(ABC):
+    """Backend in which serialized RoadRunner states are kept by label."""
+    @abstractmethod
+    def save(self, label: str, state: bytes) -> None:
+        pass
+
+    @abstractmethod
+    def load(self, label: str) -> bytes:
+        pass
+
+    @abstractmethod
+    def labels(self) -> List[str]:
+        pass
+
+    @abstractmethod
+    def fork(self, name: str) -> 'CheckpointStore':
+        """Return a new, empty store of the same kind, for example for the checkpoints of a branch named `name`."""
+        pass
+
+
+class MemoryCheckpointStore(CheckpointStore):
+    def __init__(self):
+        self._states: Dict[str, bytes] = {}
+
+    def save(self, label: str, state: bytes) -> None:
+        self._states[label] = state
+
+    def load(self, label: str) -> bytes:
+        return self._states[label]
+
+    def labels(self) -> List[str]:
+        return list(self._states.keys())
+
+    def fork(self, name: str) -> 'MemoryCheckpointStore':
+        return MemoryCheckpointStore()
+
+
+class FileCheckpointStore(CheckpointStore):
+    """Keeps each checkpoint as `<label>.rrstate` within `checkpoint_dir`, with the label percent-encoded so that it
+        cannot name a path outside of `checkpoint_dir`. Forks are kept in `<checkpoint_dir>/branches/<name>`.
+    """
+    extension = '.rrstate'
+
+    def __init__(self, checkpoint_dir: str):
+        self.checkpoint_dir = checkpoint_dir
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+
+    def _path(self, label: str) -> str:
+        return os.path.join(self.checkpoint_dir, f'{quote(label, safe="")}{self.extension}')
+
+    def save(self, label: str, state: bytes) -> None:
+        tmp_path = f'{self._path(label)}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(state)
+        os.replace(tmp_path, self._path(label))
+
+    def load(self, label: str) -> bytes:
+        with open(self._path(label), 'rb') as f:
+            return f.read()
+
+    def labels(self) -> List[str]:
+        return [
+            unquote(f[:-len(self.extension)])
+            for f in os.listdir(self.checkpoint_dir)
+            if f.endswith(self.extension)
+        ]
+
+    def fork(self, name: str) -> 'FileCheckpointStore':
+        return FileCheckpointStore(os.path.join(self.checkpoint_dir, 'branches', quote(name, safe='')))
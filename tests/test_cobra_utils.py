@@ -0,0 +1,59 @@
+import gc
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+from bsp.utils.cobra_utils import FBASolutionCache, ParallelFBAPool
+
+
+def test_solution_cache_hit_within_tolerance():
+    cache = FBASolutionCache(tolerance=0.1, max_size=2)
+    cache.put({'EX_glc__D_e': -1.0}, {'Biomass_Ecoli_core': 0.5}, {'EX_glc__D_e': 0.1})
+
+    assert cache.get({'EX_glc__D_e': -1.02}) == {'Biomass_Ecoli_core': 0.5}
+    assert cache.get({'EX_glc__D_e': -2.0}) is None
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'rejections': 0, 'size': 1}
+
+
+def test_solution_cache_rejects_above_error_bound():
+    cache = FBASolutionCache(tolerance=0.1, error_bound=0.01)
+    cache.put({'EX_glc__D_e': -1.0}, {'Biomass_Ecoli_core': 0.5}, {'EX_glc__D_e': 0.1})
+
+    assert cache.get({'EX_glc__D_e': -1.04}) is None
+    assert cache.rejections == 1
+
+
+def test_solution_cache_evicts_least_recently_used():
+    cache = FBASolutionCache(tolerance=0.1, max_size=2)
+    for i in range(3):
+        cache.put({'EX_glc__D_e': -float(i)}, {'Biomass_Ecoli_core': float(i)}, {})
+
+    assert len(cache) == 2
+    assert cache.get({'EX_glc__D_e': 0.0}) is None
+
+
+def _assert_released(names):
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
+
+
+def test_parallel_fba_pool_releases_shared_memory():
+    pool = ParallelFBAPool('TESTING', 'Biomass_Ecoli_core', ['EX_glc__D_e'], num_workers=2)
+    results = pool.solve(np.array([[-10.0], [-5.0], [-10.0]]))
+    assert results.feasible.all()
+    assert results.growth_rates[0] == results.growth_rates[2]
+
+    names = pool.shared_memory_names
+    assert len(names) == 2
+    pool.close()
+    _assert_released(names)
+
+    # a pool which is garbage collected without being closed is released too
+    pool = ParallelFBAPool('TESTING', 'Biomass_Ecoli_core', ['EX_glc__D_e'], num_workers=2)
+    pool.solve(np.array([[-10.0]]))
+    names = pool.shared_memory_names
+    del pool
+    gc.collect()
+    _assert_released(names)
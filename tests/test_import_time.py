@@ -0,0 +1,24 @@
+import json
+import os
+import subprocess
+import sys
+
+
+IMPORT_TIME_BUDGET = float(os.getenv('BSP_IMPORT_TIME_BUDGET', 3.0))  # seconds
+SIMULATOR_MODULES = ['cobra', 'basico', 'smoldyn', 'pymem3dg', 'netCDF4', 'tellurium', 'amici']
+
+
+def test_import_time_budget():
+    script = (
+        'import json, sys, time\n'
+        'start = time.perf_counter()\n'
+        'import bsp\n'
+        'duration = time.perf_counter() - start\n'
+        f'print(json.dumps({{"duration": duration, "imported": [m for m in {SIMULATOR_MODULES!r} if m in sys.modules]}}))\n'
+    )
+    output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+
+    assert result['imported'] == [], f'Simulators imported by "import bsp": {result["imported"]}'
+    assert result['duration'] < IMPORT_TIME_BUDGET, \
+        f'"import bsp" took {result["duration"]:.2f}s, over the budget of {IMPORT_TIME_BUDGET}s'
@@ -0,0 +1,43 @@
+import os
+import zipfile
+
+from bsp.io import BiomodelStore
+
+
+SBML_CONTENT = '<?xml version="1.0" encoding="UTF-8"?><sbml></sbml>'
+
+
+def test_biomodel_store_add_and_get(tmp_path):
+    store = BiomodelStore(root=str(tmp_path))
+    assert store.get('BIOMD0000000001') is None
+
+    path = store.add('BIOMD0000000001', SBML_CONTENT)
+    assert store.get('BIOMD0000000001') == path
+    assert store.verify('BIOMD0000000001')
+
+    entry = store.read_index()['BIOMD0000000001']
+    assert entry['path'] == path
+    assert 'fetched' in entry
+
+
+def test_biomodel_store_populate_from_zip(tmp_path):
+    archive_fp = os.path.join(str(tmp_path), 'mirror.zip')
+    with zipfile.ZipFile(archive_fp, 'w') as archive:
+        archive.writestr('BIOMD0000000002.xml', SBML_CONTENT)
+        archive.writestr('nested/BIOMD0000000003_url.xml', SBML_CONTENT)
+        archive.writestr('README.md', 'not a model')
+
+    store = BiomodelStore(root=os.path.join(str(tmp_path), 'store'))
+    added = store.populate(archive_fp)
+
+    assert sorted(added) == ['BIOMD0000000002', 'BIOMD0000000003']
+    assert store.get('BIOMD0000000003') is not None
+
+
+def test_biomodel_store_try_add_unwritable(tmp_path):
+    blocking_fp = os.path.join(str(tmp_path), 'file')
+    open(blocking_fp, 'w').close()
+
+    # the root of the store is below a file, so it cannot be created
+    store = BiomodelStore(root=os.path.join(blocking_fp, 'store'))
+    assert store.try_add('BIOMD0000000001', SBML_CONTENT) is None
@@ -0,0 +1,23 @@
+import numpy as np
+
+from bsp.processes.field_transport_process import advect, neumann_laplacian, upwind_advection
+
+
+def test_neumann_laplacian_conserves_mass():
+    laplacian = neumann_laplacian((4, 6), (1.0, 0.5))
+    field = np.random.uniform(size=24)
+    assert np.isclose((laplacian @ field).sum(), 0.0)
+
+
+def test_upwind_advection_conserves_mass():
+    field = np.random.uniform(size=(5, 5))
+    rate = upwind_advection(field, (1.0, -0.5), (1.0, 1.0))
+    assert np.isclose(rate.sum(), 0.0)
+
+
+def test_diagonal_advection_conserves_mass_and_stays_non_negative():
+    field = np.zeros((5, 5))
+    field[1, 1] = 1.0
+    advected = advect(field, (1.0, 1.0), (1.0, 1.0), interval=0.9)
+    assert np.isclose(advected.sum(), field.sum())
+    assert advected.min() >= 0
@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+from bsp.data_model.base import Implementation
+from bsp.registration import RegistryManifest
+
+
+CONDA_IMPLEMENTATION = Implementation(
+    address='conda-process',
+    location='processes.conda_process.CondaProcess',
+    dependencies=['conda-forge::a-conda-package'])
+
+
+MISSING_IMPLEMENTATION = Implementation(
+    address='missing-process',
+    location='processes.missing_process.MissingProcess',
+    dependencies=['a-package-which-is-not-installed'])
+
+
+def test_manifest_records_missing_dependencies(tmp_path):
+    manifest_fp = os.path.join(str(tmp_path), 'manifest.json')
+    manifest = RegistryManifest(path=manifest_fp)
+    manifest.bind([MISSING_IMPLEMENTATION])
+    assert manifest.missing_dependencies(MISSING_IMPLEMENTATION) == ['a-package-which-is-not-installed']
+
+    manifest.record(MISSING_IMPLEMENTATION.address, available=False, error='missing')
+    manifest.flush()
+
+    reloaded = RegistryManifest(path=manifest_fp)
+    reloaded.bind([MISSING_IMPLEMENTATION])
+    assert reloaded.get(MISSING_IMPLEMENTATION.address) == {'available': False, 'error': 'missing'}
+
+
+def test_manifest_skips_non_pypi_dependencies(tmp_path):
+    manifest = RegistryManifest(path=os.path.join(str(tmp_path), 'manifest.json'))
+    manifest.bind([CONDA_IMPLEMENTATION])
+    assert manifest.missing_dependencies(CONDA_IMPLEMENTATION) == []
+
+
+def test_manifest_write_is_best_effort(tmp_path):
+    blocking_fp = os.path.join(str(tmp_path), 'file')
+    open(blocking_fp, 'w').close()
+
+    # the parent of the manifest is a file, so it cannot be created
+    manifest = RegistryManifest(path=os.path.join(blocking_fp, 'manifest.json'))
+    manifest.bind([MISSING_IMPLEMENTATION])
+    manifest.record(MISSING_IMPLEMENTATION.address, available=False, error='missing')
+    with pytest.warns(UserWarning, match='Cannot write the registry manifest'):
+        manifest.flush()
+    assert manifest.get(MISSING_IMPLEMENTATION.address) == {'available': False, 'error': 'missing'}
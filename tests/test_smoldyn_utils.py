@@ -0,0 +1,84 @@
+import os
+
+import numpy as np
+
+from bsp.utils.smoldyn_utils import ParticleArrays, ParticleIndex, SmoldynOutputReader
+
+
+LISTMOLS2_ROWS = [
+    [0.0, 1, 0, 0.1, 0.2, 0.3, 7],
+    [1.0, 1, 0, 0.4, 0.5, 0.6, 7],
+    [1.0, 2, 1, 0.7, 0.8, 0.9, 9],
+]
+
+
+def test_particle_arrays_last_frame():
+    particles = ParticleArrays(LISTMOLS2_ROWS, ['a', 'b']).last_frame()
+    assert len(particles) == 2
+    assert particles.coordinates.shape == (2, 3)
+    np.testing.assert_array_equal(particles.species_index, [0, 1])
+    np.testing.assert_array_equal(particles.serial, [7, 9])
+
+
+def test_particle_dict_view():
+    view = ParticleArrays(LISTMOLS2_ROWS, ['a', 'b']).last_frame().as_dict_view()
+    assert list(view) == ['7', '9']
+    assert view['9'] == {'coordinates': [0.7, 0.8, 0.9], 'species_id': 'b', 'state': 1}
+
+
+def test_particle_index_delta():
+    index = ParticleIndex()
+    index.update(ParticleArrays([[0.0, 1, 0, 0.0, 0.0, 0.0, 1], [0.0, 1, 0, 1.0, 1.0, 1.0, 2]], ['a']))
+
+    delta = index.update(ParticleArrays([[1.0, 1, 0, 0.5, 0.0, 0.0, 1], [1.0, 1, 0, 2.0, 2.0, 2.0, 3]], ['a']))
+    np.testing.assert_array_equal(delta['added']['serial'], [3])
+    np.testing.assert_array_equal(delta['moved']['serial'], [1])
+    np.testing.assert_array_equal(delta['removed']['serial'], [2])
+
+
+def test_particle_index_forget():
+    index = ParticleIndex()
+    index.update(ParticleArrays([[0.0, 1, 0, 0.0, 0.0, 0.0, 1], [0.0, 1, 0, 1.0, 1.0, 1.0, 2]], ['a']))
+
+    # serial 1 is re-created as serial 3
+    index.forget(np.array([True, False]))
+    delta = index.update(ParticleArrays([[1.0, 1, 0, 0.0, 0.0, 0.0, 3], [1.0, 1, 0, 1.0, 1.0, 1.0, 2]], ['a']))
+    np.testing.assert_array_equal(delta['added']['serial'], [3])
+    np.testing.assert_array_equal(delta['removed']['serial'], [])
+    np.testing.assert_array_equal(delta['dropped']['serial'], [1])
+
+
+def test_output_reader_frames_and_index(tmp_path):
+    output_fp = tmp_path / 'modelout.txt'
+    output_fp.write_text(
+        '0 0.01\n'
+        'a(solution) 0.1 0.2 0.3 1\n'
+        '1 0.02\n'
+        'a(solution) 0.4 0.5 0.6 1\n'
+        'b(front) 0.7 0.8 0.9 2\n'
+        '2 0.03\n'
+        'b(front) 1.0 1.1 1.2 2\n')
+    reader = SmoldynOutputReader(str(output_fp), chunk_size=16)
+
+    frames = list(reader.iter_frames())
+    assert [time for time, _ in frames] == [0.0, 1.0, 2.0]
+    np.testing.assert_array_equal(frames[1][1]['serial'], [1, 2])
+    np.testing.assert_array_equal(frames[1][1]['state'], [0, 1])
+    assert reader.species_names() == ['a', 'b']
+    assert reader.molecule_labels() == ['a(solution)', 'b(front)']
+
+    # the second read seeks through the sidecar index
+    seeked = list(SmoldynOutputReader(str(output_fp)).iter_frames(start_time=1.5))
+    assert [time for time, _ in seeked] == [2.0]
+    np.testing.assert_array_equal(seeked[0][1]['species'], [1])
+
+
+def test_output_reader_without_writable_index(tmp_path):
+    output_fp = tmp_path / 'modelout.txt'
+    output_fp.write_text('0 0.01\na 0.1 0.2 0.3 1\n1 0.02\nb 0.4 0.5 0.6 2\n')
+    reader = SmoldynOutputReader(str(output_fp))
+
+    # the sidecar path is a directory, so the index cannot be written there
+    os.makedirs(reader.index_filepath)
+    assert reader.species_names() == ['a', 'b']
+    assert [time for time, _ in reader.iter_frames(start_time=0.5)] == [1.0]
@@ -0,0 +1,23 @@
+import os
+
+from bsp.utils.tellurium_utils import FileCheckpointStore, MemoryCheckpointStore
+
+
+def test_file_checkpoint_labels_stay_in_store(tmp_path):
+    checkpoint_dir = os.path.join(str(tmp_path), 'checkpoints')
+    store = FileCheckpointStore(checkpoint_dir)
+    store.save('../x', b'state')
+
+    assert os.listdir(str(tmp_path)) == ['checkpoints']
+    assert store.labels() == ['../x']
+    assert store.load('../x') == b'state'
+
+
+def test_forked_checkpoint_stores_are_independent(tmp_path):
+    for store in (MemoryCheckpointStore(), FileCheckpointStore(str(tmp_path))):
+        store.save('a', b'parent')
+        fork = store.fork('branch')
+        fork.save('a', b'branch')
+
+        assert store.load('a') == b'parent'
+        assert fork.labels() == ['a']
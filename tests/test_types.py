@@ -0,0 +1,38 @@
+import numpy as np
+from process_bigraph import ProcessTypes
+
+from bsp.schemas.types import ParticleArraysType, ParticleDeltaType
+
+
+def particle_arrays(serials):
+    n = len(serials)
+    return {
+        'coordinates': np.zeros((n, 3)),
+        'species_index': np.zeros(n, dtype=np.int32),
+        'state': np.zeros(n, dtype=np.int32),
+        'serial': np.asarray(serials, dtype=np.int64)
+    }
+
+
+def test_particle_arrays_replaced_by_each_update():
+    core = ProcessTypes()
+    core.register_types({'ParticleArraysType': ParticleArraysType})
+    schema = core.access('ParticleArraysType')
+
+    state = core.apply_update(schema, {}, particle_arrays([1, 2]))
+    state = core.apply_update(schema, state, particle_arrays([3]))
+    np.testing.assert_array_equal(state['serial'], [3])
+
+
+def test_particle_delta_replaced_by_each_update():
+    core = ProcessTypes()
+    core.register_types({'ParticleDeltaType': ParticleDeltaType})
+    schema = core.access('ParticleDeltaType')
+
+    empty = {'serial': np.empty(0, dtype=np.int64)}
+    state = core.apply_update(
+        schema, {}, {'added': particle_arrays([1]), 'moved': particle_arrays([]), 'removed': empty, 'dropped': empty})
+    state = core.apply_update(
+        schema, state, {'added': particle_arrays([]), 'moved': particle_arrays([1]), 'removed': empty, 'dropped': empty})
+    np.testing.assert_array_equal(state['added']['serial'], [])
+    np.testing.assert_array_equal(state['moved']['serial'], [1])